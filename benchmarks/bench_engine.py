@@ -0,0 +1,74 @@
+"""
+Benchmark of per-command latency of openstack engines: "subprocess" (new
+openstack process for each command) and "inprocess" (openstackclient shell
+running inside the current process)
+
+By default, a command without authentication ("command list") is executed,
+measuring only the startup and plugin loading overhead of the engines.
+If EGI_SITE, EGI_VO and CHECKIN_ACCESS_TOKEN are set, the given Openstack
+command is executed on the site via fedcloud_openstack_full()
+
+Usage: python benchmarks/bench_engine.py [-n REPEAT] [OPENSTACK_COMMAND ...]
+"""
+
+import argparse
+import os
+import statistics
+import time
+
+from fedcloudclient.openstack import (
+    DEFAULT_AUTH_TYPE,
+    DEFAULT_IDENTITY_PROVIDER,
+    DEFAULT_PROTOCOL,
+    OPENSTACK_ENGINES,
+    check_openstack_client_installation,
+    fedcloud_openstack_full,
+    run_openstack,
+)
+
+
+def run_command(engine, openstack_command):
+    site = os.environ.get("EGI_SITE")
+    vo = os.environ.get("EGI_VO")
+    access_token = os.environ.get("CHECKIN_ACCESS_TOKEN")
+    if site and vo and access_token:
+        error_code, result = fedcloud_openstack_full(
+            access_token,
+            DEFAULT_PROTOCOL,
+            DEFAULT_AUTH_TYPE,
+            DEFAULT_IDENTITY_PROVIDER,
+            site,
+            vo,
+            openstack_command,
+            engine=engine
+        )
+    else:
+        error_code, _, result = run_openstack(openstack_command, engine)
+    if error_code != 0:
+        raise SystemExit("Error in %s engine: %s" % (engine, result))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of openstack engines")
+    parser.add_argument("-n", "--repeat", type=int, default=10, help="number of commands per engine")
+    parser.add_argument("command", nargs="*", default=["command", "list"], help="Openstack command")
+    args = parser.parse_args()
+    openstack_command = tuple(args.command)
+
+    print("Command: %s, repeated %d times" % (" ".join(openstack_command), args.repeat))
+    print("%-12s %10s %10s %10s %10s" % ("engine", "first [s]", "mean [s]", "median [s]", "total [s]"))
+    for engine in OPENSTACK_ENGINES:
+        if not check_openstack_client_installation(engine):
+            print("%-12s not available" % engine)
+            continue
+        timings = []
+        for _ in range(args.repeat):
+            start_time = time.perf_counter()
+            run_command(engine, openstack_command)
+            timings.append(time.perf_counter() - start_time)
+        print("%-12s %10.3f %10.3f %10.3f %10.3f" % (engine, timings[0], statistics.mean(timings),
+                                                     statistics.median(timings), sum(timings)))
+
+
+if __name__ == "__main__":
+    main()
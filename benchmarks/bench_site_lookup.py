@@ -0,0 +1,65 @@
+"""
+Micro-benchmark of site and (site, VO) lookups over site configurations
+
+Synthetic site configurations with increasing numbers of sites and VOs are
+loaded into fedcloudclient.sites, then find_site_data(),
+find_endpoint_and_project_id() and find_sites_with_vo() are timed. With
+the lookup indexes, cost per lookup does not depend on the number of sites
+and VOs
+
+Usage: python benchmarks/bench_site_lookup.py
+"""
+
+import random
+import timeit
+
+from fedcloudclient import sites
+
+SIZES = ((10, 10), (100, 50), (1000, 100), (5000, 200))
+LOOKUPS = 100000
+
+
+def load_synthetic_config(site_count, vo_count):
+    sites.site_config_data.clear()
+    for i in range(site_count):
+        sites.site_config_data.append({
+            "gocdb": "SITE-%d" % i,
+            "endpoint": "https://site-%d.example.org:5000/v3/" % i,
+            "vos": [
+                {"name": "vo-%d.example.org" % j, "auth": {"project_id": "%032x" % (i * vo_count + j)}}
+                for j in range(vo_count)
+            ],
+        })
+    sites.build_site_index()
+
+
+def main():
+    print("%8s %6s %16s %16s %16s" % ("sites", "VOs", "site [us]", "site+VO [us]", "VO->sites [us]"))
+    for site_count, vo_count in SIZES:
+        load_synthetic_config(site_count, vo_count)
+        rng = random.Random(0)
+        site_names = ["SITE-%d" % rng.randrange(site_count) for _ in range(1000)]
+        vo_names = ["vo-%d.example.org" % rng.randrange(vo_count) for _ in range(1000)]
+        pairs = list(zip(site_names, vo_names))
+
+        def lookup_site():
+            for site_name in site_names:
+                sites.find_site_data(site_name)
+
+        def lookup_site_vo():
+            for site_name, vo in pairs:
+                sites.find_endpoint_and_project_id(site_name, vo)
+
+        def lookup_vo():
+            for vo in vo_names:
+                sites.find_sites_with_vo(vo)
+
+        repeat = LOOKUPS // 1000
+        results = [timeit.timeit(f, number=repeat) / LOOKUPS * 1e6 for f in (lookup_site, lookup_site_vo)]
+        # VO -> sites returns a copy of the site list, so its cost grows with the number of sites per VO
+        results.append(timeit.timeit(lookup_vo, number=1) / 1000 * 1e6)
+        print("%8d %6d %16.3f %16.3f %16.3f" % ((site_count, vo_count) + tuple(results)))
+
+
+if __name__ == "__main__":
+    main()
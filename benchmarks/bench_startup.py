@@ -0,0 +1,133 @@
+"""
+Startup benchmark of the fedcloud CLI with import-time budget
+
+Simple commands are executed in new Python processes with "-X importtime",
+and the time spent importing modules after Python startup is summed. The
+benchmark fails (exit code 1) if the import time of any command exceeds the
+budget, or if a command imports modules it does not need (e.g. requests
+for "fedcloud --help"), so it can be used as a regression check in CI.
+Commands are executed via the entry point of the fedcloud console script,
+with FEDCLOUD_NO_AGENT set, so no agent is contacted. The benchmark also
+fails if the short help of commands in "fedcloud --help", which is given
+without importing them, does not match their docstrings
+
+Budgets are set for a typical developer machine, they can be scaled for
+slower (e.g. CI) machines by --budget-scale
+
+Usage: python benchmarks/bench_startup.py [-n REPEAT] [--budget-scale FACTOR]
+"""
+
+import argparse
+import os
+import statistics
+import subprocess  # nosec
+import sys
+import time
+
+# Commands, their import-time budgets in ms and modules they must not import
+SCENARIOS = (
+    (("--help",), 60, ("requests", "yaml", "defusedxml", "tabulate", "jwt")),
+    (("token", "--help"), 120, ("requests", "yaml", "defusedxml", "tabulate")),
+    (("token", "check"), 120, ("requests", "yaml", "defusedxml", "tabulate")),
+    (("site", "--help"), 250, ("defusedxml", "tabulate", "jwt")),
+)
+
+# Same as the fedcloud console script (fedcloudclient.cli:main in setup.cfg)
+CLI_SCRIPT = "import sys; from fedcloudclient.cli import main; sys.argv[0] = 'fedcloud'; main()"
+
+
+def measure_command(arguments):
+    """
+    Run fedcloud command in new process with -X importtime
+
+    :return: import time in ms, wall time in ms, set of imported top-level packages
+    """
+    env = dict(os.environ, FEDCLOUD_NO_AGENT="1")
+    # Without tokens, "token check" stops before any network access
+    for name in ("CHECKIN_ACCESS_TOKEN", "CHECKIN_REFRESH_TOKEN"):
+        env.pop(name, None)
+    start_time = time.perf_counter()
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", CLI_SCRIPT] + list(arguments),  # nosec
+                               stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, env=env)
+    wall_time = (time.perf_counter() - start_time) * 1000
+
+    import_time = 0
+    packages = set()
+    started = False
+    for line in completed.stderr.decode().splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if cumulative.strip() == "cumulative":
+            continue
+        module = name.strip()
+        packages.add(module.split(".")[0])
+        # Only top-level imports after Python startup, starting with fedcloudclient package
+        if not started and module.startswith("fedcloudclient"):
+            started = True
+        if started and not name[1:].startswith(" "):
+            import_time += int(cumulative)
+    return import_time / 1000, wall_time, packages
+
+
+def check_short_help():
+    """
+    Compare short help of lazily loaded commands in "fedcloud --help" with short help
+    from docstrings of the commands
+
+    :return: list of failures
+    """
+    import importlib
+
+    from click.utils import make_default_short_help
+
+    from fedcloudclient.cli import LAZY_COMMANDS
+
+    failures = []
+    for command_name, (command_path, short_help) in sorted(LAZY_COMMANDS.items()):
+        module_name, attribute = command_path.split(":")
+        command = getattr(importlib.import_module(module_name), attribute)
+        expected = command.get_short_help_str(limit=1000)
+        if make_default_short_help(short_help, 1000) != expected:
+            failures.append("%s: short help %r does not match docstring %r" % (command_name, short_help, expected))
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Startup benchmark of fedcloud CLI")
+    parser.add_argument("-n", "--repeat", type=int, default=5, help="number of runs per command")
+    parser.add_argument("--budget-scale", type=float, default=1.0,
+                        help="multiply import-time budgets of all commands by this factor")
+    args = parser.parse_args()
+
+    failures = []
+    print("%-16s %12s %12s %12s  %s" % ("command", "import [ms]", "budget [ms]", "wall [ms]", "unneeded imports"))
+    for arguments, budget, forbidden in SCENARIOS:
+        budget *= args.budget_scale
+        import_times = []
+        wall_times = []
+        unneeded = set()
+        for _ in range(args.repeat):
+            import_time, wall_time, packages = measure_command(arguments)
+            import_times.append(import_time)
+            wall_times.append(wall_time)
+            unneeded |= packages & set(forbidden)
+
+        command = " ".join(arguments)
+        import_time = statistics.median(import_times)
+        print("%-16s %12.1f %12.1f %12.1f  %s" % (command, import_time, budget, statistics.median(wall_times),
+                                                  ", ".join(sorted(unneeded)) or "-"))
+        if import_time > budget:
+            failures.append("%s: import time %.1f ms over budget %.1f ms" % (command, import_time, budget))
+        if unneeded:
+            failures.append("%s: imports %s" % (command, ", ".join(sorted(unneeded))))
+
+    failures.extend(check_short_help())
+    for failure in failures:
+        print("FAILED %s" % failure)
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+"""
+Offline benchmark suite of fedcloud library entry points and CLI commands
+
+All EGI services are replaced by local stand-ins (see standins.py): GOCDB,
+Check-in, Keystone, site configuration files and the openstack client, with
+configurable number of sites and latency of every request. Each scenario is
+run once "cold" (empty cache, fresh process state) and then --repeat times
+"warm" (cache and in-process state kept). CLI commands are executed in new
+processes, so their times include Python startup and imports
+
+Results can be stored by --output and compared with stored results by
+--compare, the benchmark fails (exit code 1) if any scenario is slower than
+the stored one by more than --threshold
+
+Usage: python benchmarks/bench_suite.py [--sites N] [--latency SECONDS] [-n REPEAT]
+                                        [--output FILE] [--compare FILE] [--threshold FACTOR]
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess  # nosec
+import sys
+import tempfile
+import time
+
+from standins import VO_NAMES, configure_fedcloud, make_access_token, make_fake_openstack, site_name, start_standins
+
+from fedcloudclient import checkin, endpoint, openstack, sites, transport
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# CLI commands are executed with fedcloudclient pointed to the stand-ins
+CLI_SCRIPT = ("import sys; from standins import configure_fedcloud; "
+              "configure_fedcloud(sys.argv[1], int(sys.argv[2]), sys.argv[3]); "
+              "from fedcloudclient.cli import cli; cli(sys.argv[4:], prog_name='fedcloud')")
+
+CLIENT_ID = "bench-client"
+CLIENT_SECRET = "bench-secret"  # nosec
+REFRESH_TOKEN = "bench-refresh-token"  # nosec
+
+# Scenarios faster than this (in seconds) are not reported as regressions, their noise is too high
+MIN_COMPARED_TIME = 0.005
+
+
+def library_scenarios(checkin_url, access_token, site_count, work_dir):
+    """
+    Return library scenarios as (name, function) tuples
+    """
+    vo = VO_NAMES[0]
+    all_sites = [site_name(i) for i in range(site_count)]
+    # Warm runs of synchronization find all site configurations unchanged
+    sync_dir = os.path.join(work_dir, "site-config")
+
+    def run_openstack_sites():
+        for _ in openstack.fedcloud_openstack_sites(
+                access_token, openstack.DEFAULT_PROTOCOL, openstack.DEFAULT_AUTH_TYPE,
+                openstack.DEFAULT_IDENTITY_PROVIDER, all_sites, vo, ("server", "list"), parallel=8):
+            pass
+
+    return (
+        ("read_default_site_config", sites.read_default_site_config),
+        ("get_sites", endpoint.get_sites),
+        ("find_endpoint", lambda: endpoint.find_endpoint("org.openstack.nova")),
+        ("get_access_token", lambda: checkin.get_access_token(None, REFRESH_TOKEN, CLIENT_ID,
+                                                              CLIENT_SECRET, checkin_url)),
+        ("token_list_vos", lambda: checkin.token_list_vos(access_token, checkin_url)),
+        ("get_projects_from_sites", lambda: endpoint.get_projects_from_sites(access_token, None)),
+        ("fedcloud_openstack", lambda: openstack.fedcloud_openstack(access_token, all_sites[0], vo,
+                                                                    ("server", "list"))),
+        ("fedcloud_openstack_sites", run_openstack_sites),
+        ("sync_site_config", lambda: sites.sync_site_config(sync_dir)),
+    )
+
+
+def cli_scenarios():
+    """
+    Return CLI scenarios as (name, arguments) tuples
+    """
+    vo = VO_NAMES[0]
+    return (
+        ("fedcloud site list", ("site", "list")),
+        ("fedcloud endpoint list", ("endpoint", "list")),
+        ("fedcloud endpoint projects", ("endpoint", "projects")),
+        ("fedcloud token refresh", ("token", "refresh")),
+        ("fedcloud token list-vos", ("token", "list-vos")),
+        ("fedcloud openstack (1 site)", ("openstack", "--site", site_name(0), "--vo", vo, "server", "list")),
+        ("fedcloud openstack (all sites)", ("openstack", "--site", "ALL_SITES", "--vo", vo,
+                                            "--parallel", "8", "server", "list")),
+    )
+
+
+def reset_state(cache_dir):
+    """
+    Forget everything cached on disk and in the current process
+    """
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    sites.site_config_data.clear()
+    checkin.oidc_configurations.clear()
+    with endpoint._unscoped_token_locks_lock:
+        endpoint._unscoped_tokens.clear()
+        endpoint._unscoped_token_locks.clear()
+    transport.set_session(None)
+
+
+def measure(function, repeat, cache_dir):
+    """
+    Run function once cold and repeat times warm
+
+    :return: dict with cold time, warm median and minimum in seconds
+    """
+    times = []
+    reset_state(cache_dir)
+    for _ in range(repeat + 1):
+        start_time = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start_time)
+    return {"cold": times[0], "warm_median": statistics.median(times[1:]), "warm_min": min(times[1:])}
+
+
+def make_cli_runner(arguments, base_url, site_count, openstack_client, env):
+    def run_cli():
+        completed = subprocess.run(  # nosec
+            [sys.executable, "-c", CLI_SCRIPT, base_url, str(site_count), openstack_client] + list(arguments),
+            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, env=env)
+        if completed.returncode != 0:
+            raise RuntimeError("%s failed: %s" % (" ".join(arguments), completed.stderr.decode().strip()))
+    return run_cli
+
+
+def run_suite(site_count, latency, repeat, work_dir):
+    """
+    Run all scenarios against stand-ins
+
+    :return: dict of scenario name -> times
+    """
+    server = start_standins(site_count, latency)
+    checkin_url = server.base_url + "/oidc"
+    access_token = make_access_token()
+    openstack_client = make_fake_openstack(work_dir, latency)
+    cache_dir = os.path.join(work_dir, "cache")
+    home_dir = os.path.join(work_dir, "home")
+    os.makedirs(home_dir)
+
+    # Library and CLI use the same cache, but never local site configurations of the user
+    os.environ["HOME"] = home_dir
+    os.environ["FEDCLOUD_CACHE_DIR"] = cache_dir
+    configure_fedcloud(server.base_url, site_count, openstack_client)
+
+    results = {}
+    try:
+        for name, function in library_scenarios(checkin_url, access_token, site_count, work_dir):
+            results[name] = measure(function, repeat, cache_dir)
+            print_result(name, results[name])
+
+        env = dict(os.environ)
+        for name in list(env):
+            if name.startswith(("CHECKIN_", "EGI_", "OS_")):
+                del env[name]
+        env.update({
+            "PYTHONPATH": os.pathsep.join(filter(None, (BENCHMARK_DIR, os.path.dirname(BENCHMARK_DIR),
+                                                        env.get("PYTHONPATH")))),
+            "FEDCLOUD_NO_AGENT": "1",
+            "CHECKIN_OIDC_URL": checkin_url,
+            "CHECKIN_ACCESS_TOKEN": access_token,
+            "CHECKIN_CLIENT_ID": CLIENT_ID,
+            "CHECKIN_CLIENT_SECRET": CLIENT_SECRET,
+            "CHECKIN_REFRESH_TOKEN": REFRESH_TOKEN,
+        })
+        for name, arguments in cli_scenarios():
+            # "token refresh" needs only refresh token, other commands use access token
+            command_env = dict(env)
+            if arguments[:2] != ("token", "refresh"):
+                for variable in ("CHECKIN_CLIENT_ID", "CHECKIN_CLIENT_SECRET", "CHECKIN_REFRESH_TOKEN"):
+                    del command_env[variable]
+            runner = make_cli_runner(arguments, server.base_url, site_count, openstack_client, command_env)
+            results[name] = measure(runner, repeat, cache_dir)
+            print_result(name, results[name])
+    finally:
+        server.shutdown()
+        server.server_close()
+    return results
+
+
+def print_result(name, result):
+    print("%-32s %10.1f %10.1f %10.1f"
+          % (name, result["cold"] * 1000, result["warm_median"] * 1000, result["warm_min"] * 1000), flush=True)
+
+
+def compare_results(results, baseline, threshold):
+    """
+    Compare results with stored baseline
+
+    :return: list of regressions as strings
+    """
+    regressions = []
+    print("\n%-32s %10s %10s %10s" % ("scenario", "base [ms]", "now [ms]", "ratio"))
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        for measurement in ("cold", "warm_median"):
+            old, new = baseline[name][measurement], result[measurement]
+            ratio = new / old if old else float("inf")
+            print("%-32s %10.1f %10.1f %10.2f  %s" % (name, old * 1000, new * 1000, ratio, measurement))
+            if ratio > threshold and new > MIN_COMPARED_TIME:
+                regressions.append("%s (%s): %.1f ms, was %.1f ms" % (name, measurement, new * 1000, old * 1000))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark suite of fedcloud with local stand-in services")
+    parser.add_argument("--sites", type=int, default=20, help="number of sites in stand-in services")
+    parser.add_argument("--latency", type=float, default=0.02, help="latency of every request in seconds")
+    parser.add_argument("-n", "--repeat", type=int, default=3, help="number of warm runs per scenario")
+    parser.add_argument("--output", help="store results to this JSON file")
+    parser.add_argument("--compare", help="compare results with this JSON file stored by --output")
+    parser.add_argument("--threshold", type=float, default=1.25,
+                        help="maximal allowed ratio of new and stored times. Default: 1.25")
+    args = parser.parse_args()
+
+    print("%d sites, latency %.0f ms, %d warm runs" % (args.sites, args.latency * 1000, args.repeat))
+    print("%-32s %10s %10s %10s" % ("scenario", "cold [ms]", "warm [ms]", "min [ms]"))
+    work_dir = tempfile.mkdtemp(prefix="fedcloud-bench-")
+    try:
+        results = run_suite(args.sites, args.latency, args.repeat, work_dir)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "settings": {"sites": args.sites, "latency": args.latency, "repeat": args.repeat},
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "results": results,
+            }, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            stored = json.load(f)
+        current_settings = {"sites": args.sites, "latency": args.latency}
+        if {name: stored["settings"].get(name) for name in current_settings} != current_settings:
+            print("Warning: stored results were measured with different settings: %s" % stored["settings"])
+        regressions = compare_results(results, stored["results"], args.threshold)
+        for regression in regressions:
+            print("REGRESSION %s" % regression)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
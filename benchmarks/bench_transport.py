@@ -0,0 +1,118 @@
+"""
+Benchmark of connection reuse in the shared HTTP transport
+
+A local HTTPS stand-in for Keystone (federated authentication and scoped
+tokens) is started with a self-signed certificate generated by openssl, then
+get_scoped_token() (two POSTs per call) is timed with the pooled shared
+session and with a session opening new TCP+TLS connection for every request.
+If openssl is not available, plain HTTP is used
+
+Usage: python benchmarks/bench_transport.py [-n REPEAT] [--latency SECONDS]
+"""
+
+import argparse
+import json
+import shutil
+import ssl
+import subprocess  # nosec
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from fedcloudclient import transport
+from fedcloudclient.endpoint import get_scoped_token
+
+
+class KeystoneHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately, avoid delayed ACK stalls on kept-alive connections
+    disable_nagle_algorithm = True
+    latency = 0.0
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        time.sleep(self.latency)
+        expires_at = (datetime.utcnow() + timedelta(hours=1)).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+        body = json.dumps({"token": {"expires_at": expires_at}}).encode()
+        self.send_response(201)
+        self.send_header("X-Subject-Token", "benchmark-token")
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def make_certificate(directory):
+    """
+    Generate self-signed certificate for localhost, return (cert, key) or None
+    """
+    openssl = shutil.which("openssl")
+    if openssl is None:
+        return None
+    cert = str(Path(directory) / "cert.pem")
+    key = str(Path(directory) / "key.pem")
+    subprocess.run([openssl, "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",  # nosec
+                    "-subj", "/CN=127.0.0.1", "-addext", "subjectAltName=IP:127.0.0.1",
+                    "-keyout", key, "-out", cert],
+                   check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return cert, key
+
+
+def start_server(certificate, latency):
+    KeystoneHandler.latency = latency
+    server = ThreadingHTTPServer(("127.0.0.1", 0), KeystoneHandler)
+    scheme = "http"
+    if certificate:
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(*certificate)
+        server.socket = context.wrap_socket(server.socket, server_side=True)
+        scheme = "https"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, "%s://127.0.0.1:%d/v3/" % (scheme, server.server_address[1])
+
+
+def time_flow(session, os_auth_url, repeat):
+    transport.set_session(session)
+    start_time = time.perf_counter()
+    for _ in range(repeat):
+        get_scoped_token(os_auth_url, "access-token", "project-id")
+    return (time.perf_counter() - start_time) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of HTTP connection reuse")
+    parser.add_argument("-n", "--repeat", type=int, default=50, help="number of get_scoped_token() calls")
+    parser.add_argument("--latency", type=float, default=0.0, help="server processing time in seconds")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        certificate = make_certificate(directory)
+        server, os_auth_url = start_server(certificate, args.latency)
+
+        pooled = transport.create_session()
+        no_reuse = transport.create_session()
+        no_reuse.headers["Connection"] = "close"
+        for session in pooled, no_reuse:
+            # Ignore CA bundles and proxies from environment, trust only the generated certificate
+            session.trust_env = False
+            session.verify = certificate[0] if certificate else True
+
+        print("Keystone stand-in at %s, %d calls of get_scoped_token()" % (os_auth_url, args.repeat))
+        new_connections = time_flow(no_reuse, os_auth_url, args.repeat)
+        reused_connections = time_flow(pooled, os_auth_url, args.repeat)
+        print("new connection per request: %8.2f ms per call" % (new_connections * 1000))
+        print("pooled connections:         %8.2f ms per call" % (reused_connections * 1000))
+        print("speedup:                    %8.2fx" % (new_connections / reused_connections))
+
+        transport.set_session(None)
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
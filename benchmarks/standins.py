@@ -0,0 +1,213 @@
+"""
+Local stand-ins of EGI services for offline benchmarks: GOCDB public API
+(get_site_list, get_service_endpoint), Check-in (OIDC discovery, token and
+userinfo endpoints), Keystone (federated authentication, projects and scoped
+tokens), raw site configuration files as served by GitHub with their listing
+as served by GitHub contents API and their tar.gz bundle, and a fake
+"openstack" executable. All services run in one local HTTP server with
+configurable number of sites and latency
+"""
+
+import gzip
+import hashlib
+import io
+import json
+import os
+import stat
+import tarfile
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import jwt
+import yaml
+
+VO_NAMES = ("vo.bench.example.org", "other.bench.example.org")
+ENTITLEMENT = "urn:mace:egi.eu:group:%s:role=member#aai.egi.eu"
+
+
+def site_name(index):
+    return "BENCH-SITE-%03d" % index
+
+
+def make_access_token(lifetime=3600):
+    """
+    Make JWT access token, fedcloud checks only its expiration, not the signature
+    """
+    payload = {"iss": "https://bench.example.org/oidc", "sub": "bench-user", "exp": int(time.time()) + lifetime}
+    token = jwt.encode(payload, "benchmark", algorithm="HS256")
+    return token.decode() if isinstance(token, bytes) else token
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately, avoid delayed ACK stalls on kept-alive connections
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def send_body(self, body, status=200, content_type="application/json", headers=None):
+        if isinstance(body, str):
+            body = body.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        time.sleep(self.server.latency)
+        url = urlparse(self.path)
+        query = {name: values[0] for name, values in parse_qs(url.query).items()}
+        if url.path == "/gocdbpi/public/":
+            self.send_body(self.server.gocdb_response(query), content_type="text/xml")
+        elif url.path == "/oidc/.well-known/openid-configuration":
+            base = self.server.base_url
+            self.send_body(json.dumps({
+                "issuer": base + "/oidc",
+                "token_endpoint": base + "/oidc/token",
+                "userinfo_endpoint": base + "/oidc/userinfo",
+            }))
+        elif url.path == "/oidc/userinfo":
+            self.send_body(json.dumps({
+                "sub": "bench-user",
+                "eduperson_entitlement": [ENTITLEMENT % vo for vo in VO_NAMES],
+            }))
+        elif url.path == "/sites.tar.gz":
+            bundle = self.server.site_config_bundle()
+            etag = '"%s"' % hashlib.sha1(bundle).hexdigest()  # nosec
+            if self.headers.get("If-None-Match") == etag:
+                self.send_body(b"", status=304, headers={"ETag": etag})
+            else:
+                self.send_body(bundle, content_type="application/x-gzip", headers={"ETag": etag})
+        elif url.path == "/sites/":
+            self.send_body(json.dumps(self.server.site_config_listing()))
+        elif url.path.startswith("/sites/") and url.path.endswith(".yaml"):
+            self.send_body(self.server.site_config(url.path[len("/sites/"):-len(".yaml")]), content_type="text/plain")
+        elif url.path == "/v3/auth/projects":
+            projects = [{"id": "%032x" % i, "name": "VO:%s" % vo, "enabled": True} for i, vo in enumerate(VO_NAMES)]
+            self.send_body(json.dumps({"projects": projects}))
+        else:
+            self.send_body("Not found", status=404, content_type="text/plain")
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        time.sleep(self.server.latency)
+        path = urlparse(self.path).path
+        if path == "/oidc/token":
+            self.send_body(json.dumps({"access_token": make_access_token(), "expires_in": 3600}))
+        elif path.startswith("/v3/OS-FEDERATION/") or path == "/v3/auth/tokens":
+            expires_at = (datetime.utcnow() + timedelta(hours=1)).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+            self.send_body(json.dumps({"token": {"expires_at": expires_at}}), status=201,
+                           headers={"X-Subject-Token": "bench-token"})
+        else:
+            self.send_body("Not found", status=404, content_type="text/plain")
+
+
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, site_count, latency):
+        super().__init__(("127.0.0.1", 0), StandInHandler)
+        self.site_count = site_count
+        self.latency = latency
+        self.base_url = "http://127.0.0.1:%d" % self.server_address[1]
+
+    @property
+    def keystone_url(self):
+        return self.base_url + "/v3/"
+
+    def gocdb_response(self, query):
+        sites = [site_name(i) for i in range(self.site_count)]
+        if query.get("method") == "get_site_list":
+            return "<results>%s</results>" % "".join('<SITE NAME="%s"/>' % site for site in sites)
+        if query.get("sitename"):
+            sites = [site for site in sites if site == query["sitename"]]
+        return "<results>%s</results>" % "".join(
+            "<SERVICE_ENDPOINT><SITENAME>%s</SITENAME><SERVICE_TYPE>%s</SERVICE_TYPE><URL>%s</URL>"
+            "<IN_PRODUCTION>Y</IN_PRODUCTION><NODE_MONITORED>Y</NODE_MONITORED></SERVICE_ENDPOINT>"
+            % (site, query.get("service_type"), self.keystone_url) for site in sites)
+
+    def site_config(self, name):
+        return yaml.safe_dump({
+            "gocdb": name,
+            "endpoint": self.keystone_url,
+            "vos": [{"name": vo, "auth": {"project_id": "%032x" % i}} for i, vo in enumerate(VO_NAMES)],
+        })
+
+    def site_config_listing(self):
+        listing = []
+        for i in range(self.site_count):
+            content = self.site_config(site_name(i)).encode()
+            listing.append({
+                "type": "file",
+                "name": "%s.yaml" % site_name(i),
+                "sha": hashlib.sha1(b"blob %d\0" % len(content) + content).hexdigest(),  # nosec
+                "download_url": "%s/sites/%s.yaml" % (self.base_url, site_name(i)),
+            })
+        return listing
+
+    def site_config_bundle(self):
+        """
+        Site configurations in tar.gz archive with the layout of GitHub repository archive
+        """
+        tar_data = io.BytesIO()
+        with tarfile.open(fileobj=tar_data, mode="w") as tar:
+            for i in range(self.site_count):
+                content = self.site_config(site_name(i)).encode()
+                info = tarfile.TarInfo("bench-master/sites/%s.yaml" % site_name(i))
+                info.size = len(content)
+                tar.addfile(info, io.BytesIO(content))
+        # Fixed modification time, so the same content has the same ETag
+        return gzip.compress(tar_data.getvalue(), mtime=0)
+
+
+def start_standins(site_count=20, latency=0.0):
+    """
+    Start stand-in server in background thread
+
+    :param site_count: number of sites in GOCDB and site configurations
+    :param latency: processing time of every request in seconds
+
+    :return: StandInServer, stop it by shutdown()
+    """
+    server = StandInServer(site_count, latency)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def make_fake_openstack(directory, latency=0.0):
+    """
+    Write fake "openstack" executable printing a JSON list after latency seconds
+
+    :return: path to the executable
+    """
+    path = os.path.join(directory, "openstack")
+    with open(path, "w") as f:
+        f.write("#!/bin/sh\nsleep %s\necho '[{\"ID\": \"bench-id\", \"Name\": \"bench\"}]'\n" % latency)
+    os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR)
+    return path
+
+
+def configure_fedcloud(base_url, site_count, openstack_client):
+    """
+    Point fedcloudclient modules of the current process to the stand-ins
+
+    :param base_url: base URL of the stand-in server
+    :param site_count: number of sites of the stand-in server
+    :param openstack_client: path to fake openstack executable
+
+    :return: None
+    """
+    from fedcloudclient import endpoint, openstack, sites
+
+    endpoint.GOCDB_PUBLICURL = base_url + "/gocdbpi/public/"
+    sites.SITE_CONFIG_LISTING_URL = base_url + "/sites/"
+    sites.SITE_CONFIG_BUNDLE_URL = base_url + "/sites.tar.gz"
+    sites.DEFAULT_SITE_CONFIGS = ["%s/sites/%s.yaml" % (base_url, site_name(i)) for i in range(site_count)]
+    openstack.OPENSTACK_CLIENT = openstack_client
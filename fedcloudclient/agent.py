@@ -0,0 +1,428 @@
+"""
+Long-running fedcloud agent. The agent listens on a local Unix socket and executes
+fedcloud commands forwarded by the CLI inside its own process, so site
+configurations, OIDC configurations, HTTP connections and (with the in-process
+engine) openstack client plugins stay loaded between commands.
+
+When the agent is running, the fedcloud CLI forwards commands to it transparently:
+arguments, relevant environment variables (CHECKIN_*, EGI_*, FEDCLOUD_*, OS_*) and the
+working directory are sent to the agent, and the output is streamed back.
+Site configurations are read again when they change, OIDC configurations are
+re-read from disk cache after checkin.OIDC_MEMORY_TTL.
+Commands are executed by the agent one at a time, commands arriving while the agent
+is busy are executed locally by the CLI instead of waiting. Interactive commands are never
+forwarded. Forwarding can be disabled by setting FEDCLOUD_NO_AGENT
+"""
+
+import io
+import json
+import os
+import socket
+import socketserver
+import subprocess  # nosec
+import sys
+import threading
+import time
+import traceback
+
+import click
+
+from fedcloudclient.cache import get_cache_base_dir, get_cache_dir
+
+AGENT_SOCKET_NAME = "agent.sock"
+AGENT_LOG_NAME = "agent.log"
+
+# Environment variables forwarded from CLI to the agent
+FORWARDED_ENV_PREFIXES = ("CHECKIN_", "EGI_", "FEDCLOUD_", "OS_")
+
+# Commands always executed locally: managing the agent and interactive commands
+LOCAL_COMMANDS = ("agent", "openstack-int")
+
+# Options of the main fedcloud command followed by a value
+CLI_OPTIONS_WITH_VALUE = ("--trace",)
+
+AGENT_START_TIMEOUT = 10
+
+# Commands are executed with global state of the agent process (environment,
+# working directory, stdout/stderr), so only one command can run at a time. Other
+# commands are not queued behind it, the client executes them locally
+_command_lock = threading.Lock()
+
+# Engine for openstack commands in the agent if not set by client
+agent_engine = "subprocess"
+
+
+def get_agent_socket_path():
+    """
+    Return path of agent socket: $FEDCLOUD_AGENT_SOCKET or agent.sock in agent
+    directory of the cache (readable only by the owner). cli.agent_socket_exists()
+    checks the same path without importing this module
+
+    :return: path to the socket
+    """
+    socket_path = os.environ.get("FEDCLOUD_AGENT_SOCKET")
+    if socket_path:
+        return socket_path
+    return str(get_cache_base_dir() / "agent" / AGENT_SOCKET_NAME)
+
+
+def get_forwarded_env():
+    """
+    Return environment variables to be forwarded to the agent
+    """
+    return {name: value for name, value in os.environ.items() if name.startswith(FORWARDED_ENV_PREFIXES)}
+
+
+def connect_agent(socket_path=None):
+    """
+    Connect to the running agent
+
+    :param socket_path: path to agent socket, None for default
+
+    :return: connected socket, or None if agent is not running
+    """
+    socket_path = socket_path or get_agent_socket_path()
+    if not os.path.exists(socket_path):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+    except OSError:
+        # Stale socket of agent that did not exit cleanly
+        sock.close()
+        return None
+    return sock
+
+
+def send_message(stream, message):
+    stream.write((json.dumps(message) + "\n").encode("utf-8"))
+    stream.flush()
+
+
+def request_agent(message, socket_path=None):
+    """
+    Send request to the agent and yield its response messages
+
+    :param message: request as dict
+    :param socket_path: path to agent socket, None for default
+
+    :return: generator of response messages, None if agent is not running
+    """
+    sock = connect_agent(socket_path)
+    if sock is None:
+        return None
+
+    def read_responses():
+        with sock, sock.makefile("rwb") as stream:
+            send_message(stream, message)
+            for line in stream:
+                yield json.loads(line)
+
+    return read_responses()
+
+
+def get_command_name(args):
+    """
+    Return name of the command in CLI arguments, skipping options of the main command
+
+    :param args: CLI arguments without program name
+
+    :return: command name, None if there is no command
+    """
+    args = iter(args)
+    for arg in args:
+        if arg in CLI_OPTIONS_WITH_VALUE:
+            next(args, None)
+        elif not arg.startswith("-"):
+            return arg
+    return None
+
+
+def forward_to_agent(args):
+    """
+    Execute CLI command in the agent if it is running, printing its output
+
+    :param args: CLI arguments without program name
+
+    :return: exit code of the command, or None if the command was not forwarded
+        (agent not running or busy)
+    """
+    command = get_command_name(args)
+    if command is None or command in LOCAL_COMMANDS or os.environ.get("FEDCLOUD_NO_AGENT"):
+        return None
+    responses = request_agent({
+        "command": "run",
+        "argv": list(args),
+        "env": get_forwarded_env(),
+        "cwd": os.getcwd(),
+    })
+    if responses is None:
+        return None
+
+    try:
+        for response in responses:
+            if response.get("busy"):
+                # Agent is executing another command, which may take long
+                return None
+            if "exit_code" in response:
+                return response["exit_code"]
+            output = sys.stdout if response.get("stream") == "stdout" else sys.stderr
+            output.write(response["data"])
+            output.flush()
+    except BrokenPipeError:
+        # Output closed by consumer, e.g. "| head"
+        return 1
+    except (OSError, ValueError) as e:
+        print("Error: connection to fedcloud agent failed: %s" % e, file=sys.stderr)
+        return 1
+    print("Error: fedcloud agent closed connection without result", file=sys.stderr)
+    return 1
+
+
+class SocketWriter(io.TextIOBase):
+    """
+    Text stream sending everything written to it as messages to the client,
+    used as stdout/stderr of commands executed by the agent
+    """
+
+    def __init__(self, stream, name):
+        super().__init__()
+        self.stream = stream
+        self.name = name
+
+    @property
+    def encoding(self):
+        return "utf-8"
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        # click.echo() may write encoded text
+        if isinstance(data, bytes):
+            data = data.decode("utf-8", "replace")
+        if data:
+            send_message(self.stream, {"stream": self.name, "data": data})
+        return len(data)
+
+
+def run_forwarded_command(argv, env, cwd, stream):
+    """
+    Execute fedcloud CLI command in the agent process, with the given environment
+    variables and working directory, sending output to the client. Site configurations
+    changed since they were loaded by the agent are read again
+
+    :param argv: CLI arguments without program name
+    :param env: forwarded environment variables
+    :param cwd: working directory of the client
+    :param stream: binary stream connected to the client
+
+    :return: exit code, None if the agent is busy with another command
+    """
+    # Import here, cli imports this module for forwarding
+    from fedcloudclient.cli import cli
+    from fedcloudclient.sites import clear_outdated_site_config
+
+    if not _command_lock.acquire(blocking=False):
+        return None
+    try:
+        saved_env = dict(os.environ)
+        saved_cwd = os.getcwd()
+        saved_stdout, saved_stderr = sys.stdout, sys.stderr
+        try:
+            for name in list(os.environ):
+                if name.startswith(FORWARDED_ENV_PREFIXES) and name not in env:
+                    del os.environ[name]
+            os.environ.update(env)
+            os.environ.setdefault("FEDCLOUD_ENGINE", agent_engine)
+            os.chdir(cwd)
+            clear_outdated_site_config()
+            sys.stdout = SocketWriter(stream, "stdout")
+            sys.stderr = SocketWriter(stream, "stderr")
+            try:
+                cli.main(args=argv, prog_name="fedcloud")
+                exit_code = 0
+            except SystemExit as e:
+                if e.code is None or isinstance(e.code, int):
+                    exit_code = e.code or 0
+                else:
+                    print(e.code, file=sys.stderr)
+                    exit_code = 1
+            except Exception:
+                traceback.print_exc()
+                exit_code = 1
+        finally:
+            sys.stdout, sys.stderr = saved_stdout, saved_stderr
+            os.chdir(saved_cwd)
+            os.environ.clear()
+            os.environ.update(saved_env)
+    finally:
+        _command_lock.release()
+    return exit_code
+
+
+class AgentRequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline())
+        except ValueError:
+            return
+        command = request.get("command")
+        try:
+            if command == "run":
+                exit_code = run_forwarded_command(request["argv"], request["env"], request["cwd"], self.wfile)
+                if exit_code is None:
+                    send_message(self.wfile, {"busy": True})
+                    return
+                self.server.command_count += 1
+                send_message(self.wfile, {"exit_code": exit_code})
+            elif command == "status":
+                send_message(self.wfile, {
+                    "pid": os.getpid(),
+                    "uptime": time.time() - self.server.start_time,
+                    "commands": self.server.command_count,
+                    "engine": agent_engine,
+                })
+            elif command == "stop":
+                send_message(self.wfile, {"stopping": True})
+                threading.Thread(target=self.server.shutdown).start()
+        except OSError:
+            # Client disconnected
+            pass
+
+
+class AgentServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path):
+        super().__init__(socket_path, AgentRequestHandler)
+        self.start_time = time.time()
+        self.command_count = 0
+
+
+def serve_agent(socket_path=None, engine="subprocess"):
+    """
+    Run the agent in the current process until it is stopped
+
+    :param socket_path: path to agent socket, None for default
+    :param engine: engine for openstack commands if not set by client
+
+    :return: None
+    """
+    global agent_engine
+    agent_engine = engine
+    if socket_path is None:
+        get_cache_dir("agent")
+        socket_path = get_agent_socket_path()
+    if connect_agent(socket_path) is not None:
+        raise SystemExit("Error: fedcloud agent is already running")
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+
+    # Socket only for the owner
+    old_umask = os.umask(0o077)
+    try:
+        server = AgentServer(socket_path)
+    finally:
+        os.umask(old_umask)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+
+
+def start_agent_process(engine="subprocess"):
+    """
+    Start the agent as background process and wait until it accepts connections
+
+    :param engine: engine for openstack commands if not set by client
+
+    :return: True if the agent started
+    """
+    log_path = get_cache_dir("agent") / AGENT_LOG_NAME
+    with open(log_path, "ab") as log:
+        subprocess.Popen(  # nosec
+            [sys.executable, "-c", "from fedcloudclient.agent import serve_agent; serve_agent(engine=%r)" % engine],
+            stdin=subprocess.DEVNULL, stdout=log, stderr=log, start_new_session=True,
+            env=dict(os.environ, FEDCLOUD_NO_AGENT="1")
+        )
+    deadline = time.monotonic() + AGENT_START_TIMEOUT
+    while time.monotonic() < deadline:
+        sock = connect_agent()
+        if sock is not None:
+            sock.close()
+            return True
+        time.sleep(0.05)
+    return False
+
+
+@click.group()
+def agent():
+    """
+    Agent command group for managing fedcloud agent
+    """
+    pass
+
+
+@agent.command()
+@click.option(
+    "--engine",
+    help="Engine for openstack commands if not set by FEDCLOUD_ENGINE of the client",
+    type=click.Choice(("subprocess", "inprocess")),
+    default="subprocess",
+    show_default=True,
+)
+@click.option(
+    "--foreground",
+    help="Run agent in foreground",
+    is_flag=True,
+)
+def start(engine, foreground):
+    """
+    Start fedcloud agent
+    """
+    if foreground:
+        serve_agent(engine=engine)
+        return
+    if connect_agent() is not None:
+        raise SystemExit("Error: fedcloud agent is already running")
+    if not start_agent_process(engine):
+        raise SystemExit("Error: fedcloud agent did not start, see %s" % (get_cache_dir("agent") / AGENT_LOG_NAME))
+    print("fedcloud agent started, listening on %s" % get_agent_socket_path())
+
+
+@agent.command()
+def stop():
+    """
+    Stop fedcloud agent
+    """
+    responses = request_agent({"command": "stop"})
+    if responses is None:
+        raise SystemExit("Error: fedcloud agent is not running")
+    for _ in responses:
+        pass
+    # Wait until the agent removes its socket, so it can be started again immediately
+    deadline = time.monotonic() + AGENT_START_TIMEOUT
+    while os.path.exists(get_agent_socket_path()) and time.monotonic() < deadline:
+        time.sleep(0.05)
+    print("fedcloud agent stopped")
+
+
+@agent.command()
+def status():
+    """
+    Print status of fedcloud agent
+    """
+    responses = request_agent({"command": "status"})
+    try:
+        response = next(responses) if responses is not None else None
+    except (OSError, ValueError, StopIteration):
+        response = None
+    if response is None:
+        raise SystemExit("fedcloud agent is not running")
+    print("fedcloud agent is running on %s" % get_agent_socket_path())
+    print("PID: %d, engine: %s, uptime: %.0f s, executed commands: %d"
+          % (response["pid"], response["engine"], response["uptime"], response["commands"]))
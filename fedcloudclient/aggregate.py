@@ -0,0 +1,271 @@
+"""
+Aggregation of results of Openstack commands executed on multiple sites into one
+table with "site" and "vo" columns, e.g. for comparing "image list --long" across
+sites. The table is stored by columns (dict column name -> list of values), rows are
+filtered and sorted via lists of row indexes, so the values are never copied
+"""
+
+import csv
+import io
+import json
+import re
+
+from tabulate import tabulate
+
+# Columns added to rows of all sites
+SITE_COLUMNS = ("site", "vo")
+
+# Prefix of columns of results with the same names as SITE_COLUMNS, e.g. "result.site"
+RESERVED_COLUMN_PREFIX = "result."
+
+# Column for results that are not JSON objects, e.g. output of commands ignoring JSON format
+RESULT_COLUMN = "result"
+
+AGGREGATED_OUTPUT_FORMATS = ("table", "csv", "json")
+
+# Filter expressions COLUMN<operator>VALUE, "~" is case-insensitive regular expression search
+FILTER_OPERATORS = ("!=", ">=", "<=", "=", "~", ">", "<")
+FILTER_PATTERN = re.compile(r"^(.+?)(%s)(.*)$" % "|".join(re.escape(o) for o in FILTER_OPERATORS))
+
+# Strings compared as numbers, matched before conversion as failing float() is slow
+NUMBER_PATTERN = re.compile(r"^\s*[-+]?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?\s*$")
+
+
+def merge_site_results(site_vo_results):
+    """
+    Merge JSON results of fedcloud_openstack_site_vos() into one table. Columns of all
+    sites are merged in the order of their first appearance, missing values are None.
+    Columns of results named as SITE_COLUMNS are prefixed by RESERVED_COLUMN_PREFIX.
+    Successful results that are not JSON objects (e.g. text output) are put to
+    column RESULT_COLUMN
+
+    :param site_vo_results: iterable of tuples (site, VO, error code, result, elapsed time)
+
+    :return: table as dict column name -> list of values, list of [site, VO, error code, error message]
+        of failed sites
+    """
+    table = {column: [] for column in SITE_COLUMNS}
+    row_count = 0
+    errors = []
+    for site, vo, error_code, result, _ in site_vo_results:
+        if error_code != 0:
+            errors.append([site, vo, error_code, str(result).strip()])
+            continue
+        if isinstance(result, str):
+            result = result.strip()
+            if not result:
+                # Commands without output, e.g. "server delete"
+                continue
+        if not isinstance(result, list):
+            # "show" commands return one object
+            result = [result]
+        for row in result:
+            if not isinstance(row, dict):
+                row = {RESULT_COLUMN: row}
+            table["site"].append(site)
+            table["vo"].append(vo)
+            for column, value in row.items():
+                if column in SITE_COLUMNS:
+                    column = RESERVED_COLUMN_PREFIX + column
+                if column not in table:
+                    table[column] = [None] * row_count
+                table[column].append(value)
+            row_count += 1
+            for values in table.values():
+                if len(values) < row_count:
+                    values.append(None)
+    return table, errors
+
+
+def get_row_count(table):
+    return len(table["site"])
+
+
+def find_column(table, name):
+    """
+    Find column by name, exact match first, then case-insensitive
+
+    :param table: table from merge_site_results()
+    :param name: column name
+
+    :return: column name in the table
+    :raise ValueError: if the column does not exist
+    """
+    if name in table:
+        return name
+    for column in table:
+        if column.lower() == name.lower():
+            return column
+    raise ValueError("Unknown column %s, available columns: %s" % (name, ", ".join(table)))
+
+
+def parse_filter(expression):
+    """
+    Parse filter expression COLUMN<operator>VALUE, operators are =, !=, <, <=, >, >=
+    and ~ (case-insensitive regular expression search)
+
+    :param expression: filter expression, e.g. "Status=active" or "Size>1000000"
+
+    :return: tuple (column, operator, value)
+    :raise ValueError: if the expression is invalid
+    """
+    match = FILTER_PATTERN.match(expression)
+    if not match:
+        raise ValueError("Invalid filter %s, expected COLUMN<operator>VALUE with operator one of %s"
+                         % (expression, " ".join(FILTER_OPERATORS)))
+    column, operator, value = match.groups()
+    return column.strip(), operator, value.strip()
+
+
+def _to_number(value):
+    if isinstance(value, bool) or value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return value
+    if isinstance(value, str) and NUMBER_PATTERN.match(value):
+        return float(value)
+    return None
+
+
+def _make_predicate(operator, value):
+    if operator == "~":
+        pattern = re.compile(value, re.IGNORECASE)
+        return lambda cell: cell is not None and pattern.search(format_value(cell)) is not None
+    if operator in ("=", "!="):
+        number = _to_number(value)
+
+        def equals(cell):
+            cell_number = None if number is None else _to_number(cell)
+            if cell_number is not None:
+                return cell_number == number
+            return format_value(cell) == value
+
+        return equals if operator == "=" else (lambda cell: not equals(cell))
+
+    number = _to_number(value)
+    compare = {
+        ">": lambda a, b: a > b,
+        ">=": lambda a, b: a >= b,
+        "<": lambda a, b: a < b,
+        "<=": lambda a, b: a <= b,
+    }[operator]
+
+    def ordered(cell):
+        cell_number = _to_number(cell)
+        if number is not None and cell_number is not None:
+            return compare(cell_number, number)
+        return cell is not None and compare(format_value(cell), value)
+
+    return ordered
+
+
+def filter_rows(table, filters, rows=None):
+    """
+    Select rows matching all filters
+
+    :param table: table from merge_site_results()
+    :param filters: list of filter expressions, see parse_filter()
+    :param rows: list of row indexes to filter, None for all rows
+
+    :return: list of indexes of matching rows
+    """
+    if rows is None:
+        rows = range(get_row_count(table))
+    rows = list(rows)
+    for expression in filters:
+        column, operator, value = parse_filter(expression)
+        values = table[find_column(table, column)]
+        predicate = _make_predicate(operator, value)
+        rows = [row for row in rows if predicate(values[row])]
+    return rows
+
+
+def _sort_key(value):
+    # Numbers before strings, so columns with mixed types can be sorted
+    if type(value) is str and not NUMBER_PATTERN.match(value):
+        return 1, 0, value.lower()
+    number = _to_number(value)
+    if number is not None:
+        return 0, number, ""
+    return 1, 0, format_value(value).lower()
+
+
+def sort_rows(table, sort_by, rows=None):
+    """
+    Sort rows by columns
+
+    :param table: table from merge_site_results()
+    :param sort_by: list of column names, prefixed with "-" for descending order
+    :param rows: list of row indexes to sort, None for all rows
+
+    :return: sorted list of row indexes
+    """
+    if rows is None:
+        rows = range(get_row_count(table))
+    rows = list(rows)
+    # Stable sorts from the last key to the first one
+    for name in reversed(sort_by):
+        descending = name.startswith("-")
+        values = table[find_column(table, name[1:] if descending else name)]
+        # Empty values are last in both orders
+        empty_rows = [row for row in rows if values[row] is None or values[row] == ""]
+        rows = [row for row in rows if values[row] is not None and values[row] != ""]
+        if all(type(values[row]) in (int, float) for row in rows):
+            # Numeric column is sorted by values directly
+            rows.sort(key=values.__getitem__, reverse=descending)
+        else:
+            rows.sort(key=lambda row: _sort_key(values[row]), reverse=descending)
+        rows.extend(empty_rows)
+    return rows
+
+
+def select_columns(table, columns=None):
+    """
+    Resolve names of columns for output
+
+    :param table: table from merge_site_results()
+    :param columns: list of column names, None for all columns
+
+    :return: list of column names in the table
+    """
+    if not columns:
+        return list(table)
+    return [find_column(table, name) for name in columns]
+
+
+def format_value(value):
+    """
+    Format value for text output, lists and objects as JSON
+    """
+    if value is None:
+        return ""
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return str(value)
+
+
+def render_table(table, rows, columns, output_format="table"):
+    """
+    Render selected rows and columns
+
+    :param table: table from merge_site_results()
+    :param rows: list of row indexes
+    :param columns: list of column names
+    :param output_format: "table", "csv" or "json"
+
+    :return: rendered text without trailing line break
+    """
+    selected = [table[column] for column in columns]
+    if output_format == "json":
+        return json.dumps([{column: values[row] for column, values in zip(columns, selected)} for row in rows],
+                          indent=2)
+    if output_format == "csv":
+        output = io.StringIO()
+        writer = csv.writer(output, lineterminator="\n")
+        writer.writerow(columns)
+        writer.writerows([format_value(values[row]) for values in selected] for row in rows)
+        # Without the last line break, as the other formats
+        return output.getvalue()[:-1]
+    if output_format == "table":
+        return tabulate([[format_value(values[row]) for values in selected] for row in rows], headers=columns)
+    raise ValueError("Unknown output format %s" % output_format)
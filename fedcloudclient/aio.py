@@ -0,0 +1,488 @@
+"""
+Asyncio API of fedcloudclient. Coroutines in this module are counterparts of the
+blocking library functions (prefixed with "a"), using aiohttp for HTTP requests and
+asyncio subprocesses for openstack client, so many site/VO operations can run
+concurrently on one event loop without threads.
+
+Requires aiohttp, installed e.g. via "pip install fedcloudclient[async]".
+Caches (tokens, OIDC configuration, GOCDB responses, site configurations) are
+shared with the blocking API
+"""
+
+import asyncio
+import contextlib
+import io
+import time
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from fedcloudclient import openstack
+from fedcloudclient.checkin import (
+    get_cached_oidc_configuration,
+    get_vo_memberships,
+    store_oidc_configuration,
+)
+from fedcloudclient.cache import cache_key
+from fedcloudclient.endpoint import (
+    GOCDB_ENDPOINT_FIELDS,
+    GOCDB_SITE_FIELDS,
+    GOCDB_SITE_LIST_QUERY,
+    MAX_KEYSTONE_WORKERS,
+    filter_endpoints,
+    get_endpoint_query,
+    get_gocdb_url,
+    get_keystone_url,
+    get_protocol_candidates,
+    get_scoped_token_request,
+    get_token_expiration,
+    get_unscoped_token_url,
+    invalidate_scoped_token,
+    load_gocdb_records,
+    load_scoped_token,
+    parse_gocdb_records,
+    print_gocdb_error,
+    scoped_token_cache_key,
+    store_gocdb_records,
+    store_scoped_token,
+)
+from fedcloudclient.sites import find_endpoint_and_project_id, read_site_config, site_config_data
+from fedcloudclient.transport import DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT
+
+# Maximal number of simultaneous connections of a client session
+DEFAULT_CONNECTION_LIMIT = 100
+
+
+def check_aiohttp_installation():
+    """
+    Raise ImportError if aiohttp is not installed
+    """
+    if aiohttp is None:
+        raise ImportError("aiohttp is required for fedcloudclient asyncio API, "
+                          "install it via \"pip install fedcloudclient[async]\"")
+
+
+def create_client_session(limit=DEFAULT_CONNECTION_LIMIT):
+    """
+    Create aiohttp client session with connection pool and timeouts. Sessions can be
+    passed to all coroutines in this module, so connections are shared between them
+
+    :param limit: maximal number of simultaneous connections
+
+    :return: aiohttp.ClientSession, must be closed by caller
+    """
+    check_aiohttp_installation()
+    return aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=limit),
+        timeout=aiohttp.ClientTimeout(sock_connect=DEFAULT_CONNECT_TIMEOUT, sock_read=DEFAULT_READ_TIMEOUT),
+        trust_env=True,
+    )
+
+
+@contextlib.asynccontextmanager
+async def session_scope(session=None):
+    """
+    Use the given session, or create a temporary one if None
+    """
+    if session is not None:
+        yield session
+    else:
+        async with create_client_session() as new_session:
+            yield new_session
+
+
+async def aoidc_discover(checkin_url, session=None):
+    """
+    Asyncio version of checkin.oidc_discover()
+
+    :param checkin_url: CheckIn URL
+    :param session: aiohttp session, None for temporary session
+
+    :return: JSON object of OIDC configuration
+    """
+    oidc_config = get_cached_oidc_configuration(checkin_url)
+    if oidc_config is not None:
+        return oidc_config
+
+    async with session_scope(session) as http:
+        async with http.get(checkin_url + "/.well-known/openid-configuration") as r:
+            r.raise_for_status()
+            oidc_config = await r.json(content_type=None)
+            store_oidc_configuration(checkin_url, oidc_config, r.headers.get("Cache-Control"))
+    return oidc_config
+
+
+async def atoken_list_vos(checkin_access_token, checkin_url, session=None):
+    """
+    Asyncio version of checkin.token_list_vos()
+
+    :param checkin_access_token: access token
+    :param checkin_url: CheckIn URL
+    :param session: aiohttp session, None for temporary session
+
+    :return: list of VO names
+    """
+    async with session_scope(session) as http:
+        oidc_ep = await aoidc_discover(checkin_url, http)
+        async with http.get(
+                oidc_ep["userinfo_endpoint"],
+                headers={"Authorization": "Bearer %s" % checkin_access_token}) as r:
+            r.raise_for_status()
+            return get_vo_memberships(await r.json(content_type=None))
+
+
+async def agocdb_records(query, fields, use_cache=True, session=None):
+    """
+    Asyncio version of endpoint.iter_gocdb_records(). The response is parsed after
+    download, records are shared with the blocking API via cache
+
+    :return: list of records
+    """
+    url = get_gocdb_url(query)
+    key = cache_key(url, *fields)
+    if use_cache:
+        cached = load_gocdb_records(key)
+        if cached is not None:
+            return cached
+
+    async with session_scope(session) as http:
+        async with http.get(url) as r:
+            if r.status != 200:
+                print_gocdb_error(r.status, await r.text())
+                return []
+            records = list(parse_gocdb_records(io.BytesIO(await r.read()), fields))
+    store_gocdb_records(key, records)
+    return records
+
+
+async def aget_sites(use_cache=True, session=None):
+    """
+    Asyncio version of endpoint.get_sites()
+
+    :return: list of site IDs
+    """
+    records = await agocdb_records(GOCDB_SITE_LIST_QUERY, GOCDB_SITE_FIELDS, use_cache, session)
+    return [record["NAME"] for record in records]
+
+
+async def afind_endpoint(service_type, production=True, monitored=True, site=None, use_cache=True, session=None):
+    """
+    Asyncio version of endpoint.find_endpoint(). GOCDB site list and endpoints
+    are queried concurrently
+
+    :return: list of endpoints
+    """
+    q = get_endpoint_query(service_type, monitored, site)
+    async with session_scope(session) as http:
+        if site:
+            sites = {site}
+            records = await agocdb_records(q, GOCDB_ENDPOINT_FIELDS, use_cache, http)
+        else:
+            site_list, records = await asyncio.gather(
+                aget_sites(use_cache, http), agocdb_records(q, GOCDB_ENDPOINT_FIELDS, use_cache, http))
+            sites = set(site_list)
+    return list(filter_endpoints(records, service_type, production, sites))
+
+
+async def aget_unscoped_token(os_auth_url, access_token, protocol=None, session=None):
+    """
+    Asyncio version of endpoint.get_unscoped_token()
+
+    :return: unscoped token, protocol
+    """
+    async with session_scope(session) as http:
+        for p in get_protocol_candidates(protocol):
+            async with http.post(get_unscoped_token_url(os_auth_url, p),
+                                 headers={"Authorization": "Bearer %s" % access_token}) as r:
+                if r.status == 201:
+                    return r.headers["X-Subject-Token"], p
+    raise RuntimeError("Unable to get an scoped token")
+
+
+async def aget_cached_scoped_token(os_auth_url, access_token, project_id, site, protocol=None, session=None):
+    """
+    Asyncio version of endpoint.get_cached_scoped_token()
+
+    :return: scoped token, protocol
+    """
+    key = scoped_token_cache_key(site, project_id, access_token)
+    cached = load_scoped_token(key)
+    if cached:
+        return cached
+
+    async with session_scope(session) as http:
+        unscoped_token, protocol = await aget_unscoped_token(os_auth_url, access_token, protocol, http)
+        async with http.post(get_keystone_url(os_auth_url, "/v3/auth/tokens"),
+                             json=get_scoped_token_request(unscoped_token, project_id)) as r:
+            if r.status != 201:
+                raise RuntimeError("Unable to get an scoped token")
+            scoped_token = r.headers["X-Subject-Token"]
+            try:
+                token_data = await r.json(content_type=None)
+            except ValueError:
+                token_data = None
+    store_scoped_token(key, scoped_token, protocol, get_token_expiration(token_data))
+    return scoped_token, protocol
+
+
+async def aget_projects(os_auth_url, unscoped_token, session=None):
+    """
+    Asyncio version of endpoint.get_projects()
+
+    :return: list of projects from Keystone
+    """
+    async with session_scope(session) as http:
+        async with http.get(get_keystone_url(os_auth_url, "/v3/auth/projects"),
+                            headers={"X-Auth-Token": unscoped_token}) as r:
+            r.raise_for_status()
+            return (await r.json(content_type=None))["projects"]
+
+
+async def aget_projects_from_endpoint(access_token, ep, session=None):
+    """
+    Asyncio version of endpoint.get_projects_from_endpoint()
+
+    :return: list of projects [id, name, enabled, site]
+    """
+    async with session_scope(session) as http:
+        unscoped_token, _ = await aget_unscoped_token(ep[2], access_token, session=http)
+        return [
+            [p["id"], p["name"], p["enabled"], ep[0]]
+            for p in await aget_projects(ep[2], unscoped_token, http)
+        ]
+
+
+async def aget_projects_from_sites(access_token, site, use_cache=True, errors=None, session=None):
+    """
+    Asyncio version of endpoint.get_projects_from_sites(). Sites with errors are skipped
+
+    :param errors: if a list is given, [site, error message] of failed sites are appended to it
+
+    :return: list of projects [id, name, enabled, site]
+    """
+    async with session_scope(session) as http:
+        endpoints = await afind_endpoint("org.openstack.nova", site=site, use_cache=use_cache, session=http)
+        semaphore = asyncio.Semaphore(MAX_KEYSTONE_WORKERS)
+
+        async def projects_from_endpoint(ep):
+            async with semaphore:
+                return await aget_projects_from_endpoint(access_token, ep, http)
+
+        results = await asyncio.gather(*[projects_from_endpoint(ep) for ep in endpoints],
+                                       return_exceptions=True)
+
+    project_list = []
+    for ep, result in zip(endpoints, results):
+        if isinstance(result, (RuntimeError, ValueError, KeyError, aiohttp.ClientError, asyncio.TimeoutError)):
+            if errors is not None:
+                errors.append([ep[0], str(result)])
+        elif isinstance(result, BaseException):
+            raise result
+        else:
+            project_list.extend(result)
+    return project_list
+
+
+async def ensure_site_config():
+    """
+    Load site configurations without blocking the event loop, if not loaded yet
+    """
+    if not site_config_data:
+        await asyncio.get_running_loop().run_in_executor(None, read_site_config)
+
+
+async def arun_openstack(arguments):
+    """
+    Execute openstack client as asyncio subprocess
+
+    :param arguments: command and options for openstack client in tuple
+
+    :return: exit code, stdout, stderr
+    """
+    process = await asyncio.create_subprocess_exec(
+        openstack.OPENSTACK_CLIENT, *arguments,
+        stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+    stdout, stderr = await process.communicate()
+    return process.returncode, stdout.decode('utf-8'), stderr.decode('utf-8')
+
+
+async def afedcloud_openstack_full(
+        checkin_access_token,
+        checkin_protocol,
+        checkin_auth_type,
+        checkin_identity_provider,
+        site,
+        vo,
+        openstack_command,
+        json_output=True,
+        use_token_cache=True,
+        session=None
+):
+    """
+    Asyncio version of openstack.fedcloud_openstack_full(), parameters are the same.
+    Openstack client is executed via asyncio subprocess
+
+    :param session: aiohttp session for getting scoped token, None for temporary session
+
+    :return: error code, result or error message
+    """
+    await ensure_site_config()
+    endpoint, project_id, protocol = find_endpoint_and_project_id(site, vo)
+    if endpoint is None:
+        return 1, ("VO %s not found on site %s" % (vo, site))
+
+    if protocol is None:
+        protocol = checkin_protocol
+
+    scoped_token = None
+    if use_token_cache and openstack.can_use_scoped_token(vo, checkin_auth_type, checkin_identity_provider):
+        try:
+            scoped_token, _ = await aget_cached_scoped_token(endpoint, checkin_access_token,
+                                                             project_id, site, protocol, session)
+        except (RuntimeError, aiohttp.ClientError, asyncio.TimeoutError):
+            # Let openstack client do the authentication and report errors
+            scoped_token = None
+
+    options = openstack.build_openstack_options(
+        checkin_access_token,
+        protocol,
+        checkin_auth_type,
+        checkin_identity_provider,
+        endpoint,
+        project_id,
+        scoped_token,
+        json_output
+    )
+
+    error_code, result_str, error_message = await arun_openstack(openstack_command + options)
+
+    # The cached token may have been revoked, so do not reuse it after authentication failure
+    if (error_code != 0 and scoped_token
+            and openstack.is_authentication_error(result_str, error_message)):
+        invalidate_scoped_token(site, project_id, checkin_access_token)
+
+    return openstack.parse_openstack_output(error_code, result_str, error_message, json_output)
+
+
+async def afedcloud_openstack(
+        checkin_access_token,
+        site,
+        vo,
+        openstack_command,
+        json_output=True,
+        session=None
+):
+    """
+    Asyncio version of openstack.fedcloud_openstack(), using default EGI settings
+
+    :return: error code, result or error message
+    """
+    return await afedcloud_openstack_full(
+        checkin_access_token,
+        openstack.DEFAULT_PROTOCOL,
+        openstack.DEFAULT_AUTH_TYPE,
+        openstack.DEFAULT_IDENTITY_PROVIDER,
+        site,
+        vo,
+        openstack_command,
+        json_output,
+        session=session
+    )
+
+
+def _make_site_runner(
+        checkin_access_token,
+        checkin_protocol,
+        checkin_auth_type,
+        checkin_identity_provider,
+        vo,
+        openstack_command,
+        json_output,
+        parallel
+):
+    """
+    Return coroutine function running afedcloud_openstack_full() on one site, limited
+    to parallel concurrent runs, returning (site, error code, result, elapsed time)
+    """
+    semaphore = asyncio.Semaphore(parallel) if parallel else None
+
+    async def run_on_site(site, http):
+        async with semaphore or contextlib.AsyncExitStack():
+            start_time = time.perf_counter()
+            error_code, result = await afedcloud_openstack_full(
+                checkin_access_token,
+                checkin_protocol,
+                checkin_auth_type,
+                checkin_identity_provider,
+                site,
+                vo,
+                openstack_command,
+                json_output,
+                session=http
+            )
+            return site, error_code, result, time.perf_counter() - start_time
+
+    return run_on_site
+
+
+async def afedcloud_openstack_sites(
+        checkin_access_token,
+        checkin_protocol,
+        checkin_auth_type,
+        checkin_identity_provider,
+        sites,
+        vo,
+        openstack_command,
+        json_output=True,
+        parallel=None,
+        session=None
+):
+    """
+    Asyncio version of openstack.fedcloud_openstack_sites(). All sites run concurrently
+
+    :param parallel: maximal number of openstack clients running at the same time, None for no limit
+    :param session: aiohttp session, None for temporary session shared by all sites
+
+    :return: list of tuples (site, error code, result or error message, elapsed time in seconds)
+        in the order of sites
+    """
+    run_on_site = _make_site_runner(checkin_access_token, checkin_protocol, checkin_auth_type,
+                                    checkin_identity_provider, vo, openstack_command, json_output, parallel)
+    await ensure_site_config()
+    async with session_scope(session) as http:
+        return await asyncio.gather(*[run_on_site(site, http) for site in sites])
+
+
+async def afedcloud_openstack_sites_as_completed(
+        checkin_access_token,
+        checkin_protocol,
+        checkin_auth_type,
+        checkin_identity_provider,
+        sites,
+        vo,
+        openstack_command,
+        json_output=True,
+        parallel=None,
+        session=None
+):
+    """
+    Like afedcloud_openstack_sites(), but async generator yielding result of each site
+    as soon as the site finishes
+
+    :return: async generator of tuples (site, error code, result or error message,
+        elapsed time in seconds) in the order of completion
+    """
+    run_on_site = _make_site_runner(checkin_access_token, checkin_protocol, checkin_auth_type,
+                                    checkin_identity_provider, vo, openstack_command, json_output, parallel)
+    await ensure_site_config()
+    async with session_scope(session) as http:
+        tasks = [asyncio.ensure_future(run_on_site(site, http)) for site in sites]
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield await task
+        finally:
+            # Consumer stopped early, do not leave openstack clients running
+            for task in tasks:
+                task.cancel()
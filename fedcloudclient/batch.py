@@ -0,0 +1,420 @@
+"""
+Execution of batch job files: many Openstack commands on many sites and VOs
+in one fedcloud process. Access token, site configurations and scoped Keystone
+tokens are resolved only once for the whole batch
+
+Job file is YAML with list of jobs, each with site, VO and Openstack command,
+and optional defaults for all jobs:
+
+    defaults:
+      vo: vo.example.org
+    jobs:
+      - site: SITE-A
+        command: image list
+      - site: ALL_SITES          # all sites supporting the VO
+        command: [server, list, --long]
+      - site: SITE-B
+        vo: other.vo.example.org
+        command: server delete my-vm
+        json: false              # command without JSON output
+"""
+
+import json
+import shlex
+import sys
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timezone
+
+import click
+import requests
+import yaml
+
+from fedcloudclient.checkin import get_access_token, DEFAULT_CHECKIN_URL
+from fedcloudclient.endpoint import get_cached_scoped_token
+from fedcloudclient.openstack import (
+    DEFAULT_AUTH_TYPE,
+    DEFAULT_ENGINE,
+    DEFAULT_IDENTITY_PROVIDER,
+    DEFAULT_PROTOCOL,
+    OPENSTACK_ENGINES,
+    can_use_scoped_token,
+    check_openstack_client_installation,
+    fedcloud_openstack_full,
+)
+from fedcloudclient.sites import find_endpoint_and_project_id, find_sites_with_vo
+
+# Maximal number of jobs running at the same time, in total and on one site
+DEFAULT_BATCH_PARALLEL = 8
+DEFAULT_BATCH_PARALLEL_PER_SITE = 2
+
+DEFAULT_RESULT_FILE = "batch-results.json"
+
+
+def load_batch_jobs(job_file):
+    """
+    Read jobs from YAML job file. Sites "ALL_SITES" are expanded to all sites
+    supporting the VO according to site configurations
+
+    :param job_file: path to job file
+
+    :return: list of jobs, each a dict with name, site, vo, command (tuple) and json
+    """
+    with open(job_file) as f:
+        try:
+            content = yaml.safe_load(f)
+        except yaml.YAMLError as e:
+            raise RuntimeError("Invalid YAML in job file %s: %s" % (job_file, e))
+
+    defaults = {}
+    if isinstance(content, dict):
+        defaults = content.get("defaults") or {}
+        content = content.get("jobs")
+    if not isinstance(content, list) or not isinstance(defaults, dict):
+        raise RuntimeError("Job file %s must contain list of jobs" % job_file)
+
+    jobs = []
+    for number, job_spec in enumerate(content, 1):
+        if not isinstance(job_spec, dict):
+            raise RuntimeError("Job %d is not a mapping" % number)
+        job_spec = dict(defaults, **job_spec)
+
+        site = job_spec.get("site")
+        vo = job_spec.get("vo")
+        command = job_spec.get("command")
+        if not site or not command:
+            raise RuntimeError("Job %d must have site and command" % number)
+        if isinstance(command, str):
+            command = shlex.split(command)
+        command = tuple(str(part) for part in command)
+        name = job_spec.get("name") or " ".join(command)
+
+        if site == "ALL_SITES":
+            if vo is None:
+                raise RuntimeError("Job %d with ALL_SITES must have VO" % number)
+            sites = find_sites_with_vo(vo)
+        else:
+            sites = [site]
+
+        for current_site in sites:
+            jobs.append({
+                "name": name,
+                "site": current_site,
+                "vo": vo,
+                "command": command,
+                "json": bool(job_spec.get("json", True)),
+            })
+    return jobs
+
+
+def prepare_scoped_tokens(
+        checkin_access_token,
+        checkin_protocol,
+        checkin_auth_type,
+        checkin_identity_provider,
+        site_vo_pairs,
+        parallel=DEFAULT_BATCH_PARALLEL
+):
+    """
+    Get scoped tokens for all (site, VO) pairs into the token cache, so jobs on the
+    same site and VO do not authenticate again
+
+    :param checkin_access_token: Checkin access token
+    :param checkin_protocol: Checkin protocol (openid, oidc)
+    :param checkin_auth_type: Checkin authentication type (v3oidcaccesstoken)
+    :param checkin_identity_provider: Checkin identity provider in mapping (egi.eu)
+    :param site_vo_pairs: set of (site, VO) tuples
+    :param parallel: maximal number of sites authenticated at the same time
+
+    :return: set of (site, VO) pairs where scoped token could not be obtained
+    """
+
+    def authenticate(site_vo):
+        site, vo = site_vo
+        if not can_use_scoped_token(vo, checkin_auth_type, checkin_identity_provider):
+            return site_vo, False
+        endpoint, project_id, protocol = find_endpoint_and_project_id(site, vo)
+        if endpoint is None:
+            # Reported by the jobs themselves
+            return site_vo, False
+        try:
+            get_cached_scoped_token(endpoint, checkin_access_token, project_id, site,
+                                    protocol or checkin_protocol)
+        except (RuntimeError, requests.exceptions.RequestException):
+            return site_vo, True
+        return site_vo, False
+
+    if not site_vo_pairs:
+        return set()
+    with ThreadPoolExecutor(max_workers=min(parallel, len(site_vo_pairs))) as executor:
+        return {site_vo for site_vo, failed in executor.map(authenticate, site_vo_pairs) if failed}
+
+
+def run_batch_jobs(
+        checkin_access_token,
+        jobs,
+        checkin_protocol=DEFAULT_PROTOCOL,
+        checkin_auth_type=DEFAULT_AUTH_TYPE,
+        checkin_identity_provider=DEFAULT_IDENTITY_PROVIDER,
+        parallel=DEFAULT_BATCH_PARALLEL,
+        parallel_per_site=DEFAULT_BATCH_PARALLEL_PER_SITE,
+        engine=DEFAULT_ENGINE
+):
+    """
+    Execute jobs concurrently, with at most parallel jobs in total and at most
+    parallel_per_site jobs on the same site. Sites are served in round robin,
+    so a site with many jobs does not delay the other sites
+
+    :param checkin_access_token: Checkin access token
+    :param jobs: list of jobs from load_batch_jobs()
+    :param checkin_protocol: Checkin protocol (openid, oidc)
+    :param checkin_auth_type: Checkin authentication type (v3oidcaccesstoken)
+    :param checkin_identity_provider: Checkin identity provider in mapping (egi.eu)
+    :param parallel: maximal number of jobs running at the same time
+    :param parallel_per_site: maximal number of jobs running on one site at the same time
+    :param engine: "subprocess" or "inprocess", see fedcloud_openstack_full()
+
+    :return: generator of tuples (job index, error code, result or error message,
+        elapsed time in seconds) in the order of completion
+    """
+    failed_site_vos = prepare_scoped_tokens(
+        checkin_access_token,
+        checkin_protocol,
+        checkin_auth_type,
+        checkin_identity_provider,
+        {(job["site"], job["vo"]) for job in jobs},
+        parallel
+    )
+
+    def run_job(index):
+        job = jobs[index]
+        start_time = time.perf_counter()
+        error_code, result = fedcloud_openstack_full(
+            checkin_access_token,
+            checkin_protocol,
+            checkin_auth_type,
+            checkin_identity_provider,
+            job["site"],
+            job["vo"],
+            job["command"],
+            job["json"],
+            # Do not repeat failed authentication for every job, let openstack client report it
+            use_token_cache=(job["site"], job["vo"]) not in failed_site_vos,
+            engine=engine
+        )
+        return index, error_code, result, time.perf_counter() - start_time
+
+    site_queues = {}
+    for index, job in enumerate(jobs):
+        site_queues.setdefault(job["site"], deque()).append(index)
+    running = dict.fromkeys(site_queues, 0)
+    pending = {}
+
+    with ThreadPoolExecutor(max_workers=max(1, min(parallel, len(jobs)))) as executor:
+
+        def submit_ready_jobs():
+            submitted = True
+            while submitted and len(pending) < parallel:
+                submitted = False
+                for site, queue in site_queues.items():
+                    if len(pending) >= parallel:
+                        break
+                    if queue and running[site] < parallel_per_site:
+                        running[site] += 1
+                        pending[executor.submit(run_job, queue.popleft())] = site
+                        submitted = True
+
+        submit_ready_jobs()
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                running[pending.pop(future)] -= 1
+            submit_ready_jobs()
+            for future in done:
+                yield future.result()
+
+
+def write_batch_results(result_file, jobs, results, started_at, total_time):
+    """
+    Write results of batch jobs to JSON file, in the order of jobs
+
+    :param result_file: path to result file
+    :param jobs: list of jobs from load_batch_jobs()
+    :param results: dict job index -> (error code, result or error message, elapsed time)
+    :param started_at: start time of the batch as datetime
+    :param total_time: duration of the batch in seconds
+
+    :return: None
+    """
+    records = []
+    for index, job in enumerate(jobs):
+        error_code, result, elapsed_time = results[index]
+        record = {
+            "name": job["name"],
+            "site": job["site"],
+            "vo": job["vo"],
+            "command": list(job["command"]),
+            "error_code": error_code,
+            "elapsed": round(elapsed_time, 3),
+        }
+        if error_code == 0:
+            record["result"] = result
+        else:
+            record["error"] = result
+        records.append(record)
+
+    with open(result_file, "w") as f:
+        json.dump({
+            "started_at": started_at.isoformat(),
+            "total_time": round(total_time, 3),
+            "jobs": len(jobs),
+            "failed": sum(1 for record in records if record["error_code"] != 0),
+            "results": records,
+        }, f, indent=2)
+
+
+@click.command()
+@click.option(
+    "--checkin-client-id",
+    help="Check-in client id",
+    envvar="CHECKIN_CLIENT_ID",
+)
+@click.option(
+    "--checkin-client-secret",
+    help="Check-in client secret",
+    envvar="CHECKIN_CLIENT_SECRET",
+)
+@click.option(
+    "--checkin-refresh-token",
+    help="Check-in refresh token",
+    envvar="CHECKIN_REFRESH_TOKEN",
+)
+@click.option(
+    "--checkin-access-token",
+    help="Check-in access token",
+    envvar="CHECKIN_ACCESS_TOKEN",
+)
+@click.option(
+    "--checkin-url",
+    help="Check-in OIDC URL",
+    envvar="CHECKIN_OIDC_URL",
+    default=DEFAULT_CHECKIN_URL,
+    show_default=True,
+)
+@click.option(
+    "--checkin-protocol",
+    help="Check-in protocol",
+    envvar="CHECKIN_PROTOCOL",
+    default=DEFAULT_PROTOCOL,
+    show_default=True,
+)
+@click.option(
+    "--checkin-auth-type",
+    help="Check-in authentication type",
+    envvar="CHECKIN_AUTH_TYPE",
+    default=DEFAULT_AUTH_TYPE,
+    show_default=True,
+)
+@click.option(
+    "--checkin-provider",
+    help="Check-in identity provider",
+    envvar="CHECKIN_PROVIDER",
+    default=DEFAULT_IDENTITY_PROVIDER,
+    show_default=True,
+)
+@click.option(
+    "--parallel",
+    help="Maximal number of jobs running at the same time",
+    type=click.IntRange(min=1),
+    envvar="FEDCLOUD_BATCH_PARALLEL",
+    default=DEFAULT_BATCH_PARALLEL,
+    show_default=True,
+)
+@click.option(
+    "--parallel-per-site",
+    help="Maximal number of jobs running on one site at the same time",
+    type=click.IntRange(min=1),
+    envvar="FEDCLOUD_BATCH_PARALLEL_PER_SITE",
+    default=DEFAULT_BATCH_PARALLEL_PER_SITE,
+    show_default=True,
+)
+@click.option(
+    "--engine",
+    help="Run openstack client as subprocess or inside fedcloud process",
+    type=click.Choice(OPENSTACK_ENGINES),
+    envvar="FEDCLOUD_ENGINE",
+    default=DEFAULT_ENGINE,
+    show_default=True,
+)
+@click.option(
+    "--result-file",
+    help="File for results of all jobs in JSON format",
+    default=DEFAULT_RESULT_FILE,
+    show_default=True,
+)
+@click.argument(
+    "job_file",
+    type=click.Path(exists=True, dir_okay=False),
+)
+def batch(
+        checkin_client_id,
+        checkin_client_secret,
+        checkin_refresh_token,
+        checkin_access_token,
+        checkin_url,
+        checkin_protocol,
+        checkin_auth_type,
+        checkin_provider,
+        parallel,
+        parallel_per_site,
+        engine,
+        result_file,
+        job_file
+):
+    """
+    Executing Openstack commands from job file on sites and VOs
+    """
+
+    if not check_openstack_client_installation(engine):
+        print("Error: Openstack command-line client \"openstack\" not found")
+        exit(1)
+
+    try:
+        jobs = load_batch_jobs(job_file)
+    except RuntimeError as e:
+        raise SystemExit("Error: %s" % e)
+
+    access_token = get_access_token(checkin_access_token,
+                                    checkin_refresh_token,
+                                    checkin_client_id,
+                                    checkin_client_secret,
+                                    checkin_url)
+
+    started_at = datetime.now(timezone.utc)
+    start_time = time.perf_counter()
+    results = {}
+    # Progress goes to the stderr taken before the jobs are started, never into captured output of jobs
+    progress = sys.stderr
+    for index, error_code, result, elapsed_time in run_batch_jobs(
+            access_token,
+            jobs,
+            checkin_protocol,
+            checkin_auth_type,
+            checkin_provider,
+            parallel,
+            parallel_per_site,
+            engine
+    ):
+        results[index] = (error_code, result, elapsed_time)
+        job = jobs[index]
+        status = "OK" if error_code == 0 else "Error code %d" % error_code
+        print("[%d/%d] Site: %s, VO: %s, Job: %s: %s (%.2f s)"
+              % (len(results), len(jobs), job["site"], job["vo"], job["name"], status, elapsed_time),
+              file=progress, flush=True)
+
+    total_time = time.perf_counter() - start_time
+    write_batch_results(result_file, jobs, results, started_at, total_time)
+    failed = sum(1 for error_code, _, _ in results.values() if error_code != 0)
+    print("Finished %d jobs (%d failed) in %.2f s, results saved in %s"
+          % (len(jobs), failed, total_time, result_file))
@@ -0,0 +1,147 @@
+"""
+Simple on-disk cache for data that are expensive to retrieve, e.g. Keystone tokens.
+Entries are JSON files readable only by the owner, stored in subdirectories
+(namespaces) of the cache directory ~/.fedcloud-cache/ (or $FEDCLOUD_CACHE_DIR)
+"""
+
+import contextlib
+import hashlib
+import json
+import os
+import tempfile
+import time
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:     # not available on Windows
+    fcntl = None
+
+DEFAULT_CACHE_DIR = ".fedcloud-cache/"
+
+
+def get_cache_base_dir():
+    """
+    Return the cache directory, without creating it
+
+    :return: path to the directory
+    """
+    base_dir = os.environ.get("FEDCLOUD_CACHE_DIR")
+    if base_dir:
+        return Path(base_dir)
+    return Path.home() / DEFAULT_CACHE_DIR
+
+
+def get_cache_dir(namespace):
+    """
+    Return directory of the cache namespace, create it if not exist
+
+    :param namespace: name of the namespace (subdirectory)
+
+    :return: path to the directory
+    """
+    base_dir = get_cache_base_dir()
+    base_dir.mkdir(mode=0o700, parents=True, exist_ok=True)
+    cache_dir = base_dir / namespace
+    cache_dir.mkdir(mode=0o700, exist_ok=True)
+    return cache_dir
+
+
+def cache_key(*parts):
+    """
+    Make cache key from parts, e.g. site, project and identity.
+    Keys are hashes, so no secret is visible in file names
+
+    :param parts: strings identifying the cached value
+
+    :return: cache key
+    """
+    return hashlib.sha256("\0".join(str(p) for p in parts).encode("utf-8")).hexdigest()
+
+
+def load_entry(namespace, key):
+    """
+    Load cached value
+
+    :param namespace: cache namespace
+    :param key: cache key
+
+    :return: cached value, or None if not found or expired
+    """
+    try:
+        with (get_cache_dir(namespace) / (key + ".json")).open() as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    expires_at = entry.get("expires_at")
+    if expires_at is not None and expires_at <= time.time():
+        return None
+    return entry.get("value")
+
+
+def store_entry(namespace, key, value, expires_at=None):
+    """
+    Store value in cache. Failures are ignored, as the cache is only an optimization
+
+    :param namespace: cache namespace
+    :param key: cache key
+    :param value: JSON serializable value
+    :param expires_at: expiration timestamp, None for no expiration
+
+    :return: None
+    """
+    try:
+        cache_dir = get_cache_dir(namespace)
+        # mkstemp() creates file with 0600 permission, rename it to make the write atomic
+        fd, tmp_name = tempfile.mkstemp(dir=str(cache_dir), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump({"expires_at": expires_at, "value": value}, f)
+            os.replace(tmp_name, str(cache_dir / (key + ".json")))
+        except BaseException:
+            os.unlink(tmp_name)
+            raise
+    except OSError:
+        pass
+
+
+def delete_entry(namespace, key):
+    """
+    Remove value from cache
+
+    :param namespace: cache namespace
+    :param key: cache key
+
+    :return: None
+    """
+    try:
+        (get_cache_dir(namespace) / (key + ".json")).unlink()
+    except OSError:
+        pass
+
+
+@contextlib.contextmanager
+def file_lock(namespace, key):
+    """
+    Exclusive lock of cache entry shared between processes, e.g. for avoiding
+    parallel refreshes of the same token. No locking if not supported by platform
+
+    :param namespace: cache namespace
+    :param key: cache key
+
+    :return: context manager holding the lock
+    """
+    try:
+        fd = os.open(str(get_cache_dir(namespace) / (key + ".lock")), os.O_RDWR | os.O_CREAT, 0o600)
+    except OSError:
+        fd = None
+    if fd is None or fcntl is None:
+        yield
+        return
+
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)
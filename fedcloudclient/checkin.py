@@ -6,22 +6,109 @@ from datetime import datetime
 
 import click
 import jwt
-from tabulate import tabulate
-import requests
+from fedcloudclient.cache import cache_key, file_lock, load_entry, store_entry
+from fedcloudclient.trace import span
 
 DEFAULT_CHECKIN_URL = "https://aai.egi.eu/oidc"
 
+# Time to live of cached OIDC configuration (in seconds) if not given by Cache-Control header
+DEFAULT_OIDC_DISCOVERY_TTL = 24 * 3600
+
+# Cached access tokens are refreshed if they expire in less than this time (in seconds)
+ACCESS_TOKEN_EXPIRATION_MARGIN = 300
+
+# Maximal time (in seconds) OIDC configurations are kept in memory, long-running processes
+# (agent) then read them again from disk cache, which enforces their time to live
+OIDC_MEMORY_TTL = 300
+
+# OIDC configurations discovered by the current process: CheckIn URL -> (OIDC configuration,
+# expiration time by time.monotonic())
+oidc_configurations = {}
+
+
+def get_session():
+    """
+    Return the shared HTTP session. The transport (and requests) is imported only
+    when needed, so offline commands like "token check" start faster
+    """
+    from fedcloudclient.transport import get_session as get_shared_session
+    return get_shared_session()
+
+
+def get_cache_control_max_age(cache_control):
+    """
+    Get time to live from Cache-Control header
+
+    :param cache_control: value of Cache-Control header or None
+    :return: max-age in seconds, 0 if response must not be stored, None if not specified
+    """
+    if not cache_control:
+        return None
+    directives = [d.strip().lower() for d in cache_control.split(",")]
+    if "no-store" in directives or "no-cache" in directives:
+        return 0
+    for directive in directives:
+        if directive.startswith("max-age="):
+            try:
+                return max(int(directive[len("max-age="):]), 0)
+            except ValueError:
+                return None
+    return None
+
 
 def oidc_discover(checkin_url):
     """
-    Discover oidc endpoints
+    Discover oidc endpoints. OIDC configuration is cached in memory and on disk,
+    respecting Cache-Control header of the response
 
     :param checkin_url: CheckIn URL
     :return: JSON object of OIDC configuration
     """
-    r = requests.get(checkin_url + "/.well-known/openid-configuration")
-    r.raise_for_status()
-    return r.json()
+    with span("OIDC discovery", "checkin") as s:
+        oidc_config = get_cached_oidc_configuration(checkin_url)
+        s.set(cached=oidc_config is not None)
+        if oidc_config is None:
+            r = get_session().get(checkin_url + "/.well-known/openid-configuration")
+            r.raise_for_status()
+            oidc_config = r.json()
+            store_oidc_configuration(checkin_url, oidc_config, r.headers.get("Cache-Control"))
+    return oidc_config
+
+
+def get_cached_oidc_configuration(checkin_url):
+    """
+    Get OIDC configuration from memory or disk cache
+
+    :param checkin_url: CheckIn URL
+    :return: JSON object of OIDC configuration, None if not cached
+    """
+    cached = oidc_configurations.get(checkin_url)
+    if cached is not None and cached[1] > time.monotonic():
+        return cached[0]
+    oidc_config = load_entry("oidc-discovery", cache_key(checkin_url))
+    if oidc_config is not None:
+        oidc_configurations[checkin_url] = (oidc_config, time.monotonic() + OIDC_MEMORY_TTL)
+    else:
+        oidc_configurations.pop(checkin_url, None)
+    return oidc_config
+
+
+def store_oidc_configuration(checkin_url, oidc_config, cache_control=None):
+    """
+    Store discovered OIDC configuration in memory and on disk
+
+    :param checkin_url: CheckIn URL
+    :param oidc_config: JSON object of OIDC configuration
+    :param cache_control: Cache-Control header of the discovery response
+
+    :return: None
+    """
+    ttl = get_cache_control_max_age(cache_control)
+    if ttl is None:
+        ttl = DEFAULT_OIDC_DISCOVERY_TTL
+    oidc_configurations[checkin_url] = (oidc_config, time.monotonic() + min(ttl, OIDC_MEMORY_TTL))
+    if ttl > 0:
+        store_entry("oidc-discovery", cache_key(checkin_url), oidc_config, time.time() + ttl)
 
 
 def token_refresh(
@@ -47,11 +134,12 @@ def token_refresh(
         "scope": "openid email profile offline_access",
     }
 
-    r = requests.post(
-        oidc_ep["token_endpoint"],
-        auth=(checkin_client_id, checkin_client_secret),
-        data=refresh_data
-    )
+    with span("Check-in token refresh", "checkin"):
+        r = get_session().post(
+            oidc_ep["token_endpoint"],
+            auth=(checkin_client_id, checkin_client_secret),
+            data=refresh_data
+        )
     r.raise_for_status()
     return r.json()
 
@@ -76,6 +164,51 @@ def refresh_access_token(
     )["access_token"]
 
 
+def get_cached_access_token(
+        checkin_client_id, checkin_client_secret, checkin_refresh_token, checkin_url
+):
+    """
+    Retrieve access token from the access token store shared by all fedcloud processes
+    of the user. New access token is obtained from refresh token only if the cached one
+    does not exist or expires in less than ACCESS_TOKEN_EXPIRATION_MARGIN seconds
+
+    :param checkin_client_id:
+    :param checkin_client_secret:
+    :param checkin_refresh_token:
+    :param checkin_url:
+    :return: access token
+    """
+    key = cache_key(checkin_url, checkin_client_id, checkin_refresh_token)
+    with span("access token cache", "checkin"):
+        access_token = load_entry("access-tokens", key)
+    if access_token:
+        return access_token
+
+    # Only one process refreshes the token, others wait and use the new one
+    with file_lock("access-tokens", key):
+        access_token = load_entry("access-tokens", key)
+        if access_token:
+            return access_token
+
+        refresh_time = time.time()
+        output = token_refresh(
+            checkin_client_id,
+            checkin_client_secret,
+            checkin_refresh_token,
+            checkin_url)
+        access_token = output["access_token"]
+        try:
+            expiration_timestamp = int(jwt.decode(access_token, verify=False)["exp"])
+        except (jwt.exceptions.InvalidTokenError, KeyError, ValueError):
+            expiration_timestamp = None
+        if expiration_timestamp is None and output.get("expires_in"):
+            expiration_timestamp = refresh_time + int(output["expires_in"])
+        if expiration_timestamp is not None:
+            store_entry("access-tokens", key, access_token,
+                        expiration_timestamp - ACCESS_TOKEN_EXPIRATION_MARGIN)
+    return access_token
+
+
 def get_access_token(
         checkin_access_token,
         checkin_refresh_token,
@@ -85,7 +218,7 @@ def get_access_token(
 ):
     """
     Getting access token.
-    Generate new access token from refresh token (if given) or use existing token
+    Get access token from refresh token (if given) via access token store, or use existing token
     Check expiration time of access token
     Raise error if no valid token exists
 
@@ -100,12 +233,12 @@ def get_access_token(
     if (checkin_refresh_token and checkin_client_id
             and checkin_client_secret and checkin_url):
 
-        # Always getting new access token if refresh token exist
-        return token_refresh(
+        # Reuse the stored access token until it is near expiration
+        return get_cached_access_token(
             checkin_client_id,
             checkin_client_secret,
             checkin_refresh_token,
-            checkin_url)["access_token"]
+            checkin_url)
     elif checkin_access_token:
 
         # Check expiration time of access token
@@ -134,14 +267,25 @@ def token_list_vos(checkin_access_token, checkin_url):
     :return: list of VO names
     """
     oidc_ep = oidc_discover(checkin_url)
-    r = requests.get(
-        oidc_ep["userinfo_endpoint"],
-        headers={"Authorization": "Bearer %s" % checkin_access_token})
+    with span("Check-in userinfo", "checkin"):
+        r = get_session().get(
+            oidc_ep["userinfo_endpoint"],
+            headers={"Authorization": "Bearer %s" % checkin_access_token})
 
     r.raise_for_status()
+    return get_vo_memberships(r.json())
+
+
+def get_vo_memberships(userinfo):
+    """
+    Extract VO memberships from entitlements in user info
+
+    :param userinfo: JSON object from userinfo endpoint
+    :return: list of VO names
+    """
     vos = []
     m = re.compile("urn:mace:egi.eu:group:(.*.):role=member#aai.egi.eu")
-    for claim in r.json().get("eduperson_entitlement", []):
+    for claim in userinfo.get("eduperson_entitlement", []):
         vo = m.match(claim)
         if vo:
             vos.append(vo.groups()[0])
@@ -197,6 +341,7 @@ def refresh(
         checkin_refresh_token,
         checkin_url
     )
+    from tabulate import tabulate
     print(tabulate([(k, v) for k, v in output.items()], headers=["Field", "Value"]))
 
 
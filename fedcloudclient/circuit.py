@@ -0,0 +1,80 @@
+"""
+Circuit breaker for sites in multi-site operations, persisted in the cache
+(namespace "circuit"), so it is shared by all fedcloud processes of the user.
+
+Sites that could not be reached or timed out several times in a row are skipped
+for a cooldown period after their last failure, instead of making every
+ALL_SITES operation wait for them. Failures are forgotten after the cooldown
+period, or after the first success. The breaker can be tuned via environment
+variables FEDCLOUD_CIRCUIT_THRESHOLD (number of failures, 0 disables the
+breaker) and FEDCLOUD_CIRCUIT_COOLDOWN (in seconds)
+"""
+
+import os
+import time
+
+from fedcloudclient.cache import cache_key, delete_entry, file_lock, load_entry, store_entry
+
+DEFAULT_CIRCUIT_THRESHOLD = 3
+DEFAULT_CIRCUIT_COOLDOWN = 300
+
+
+def get_circuit_threshold():
+    try:
+        return int(os.environ.get("FEDCLOUD_CIRCUIT_THRESHOLD", DEFAULT_CIRCUIT_THRESHOLD))
+    except ValueError:
+        return DEFAULT_CIRCUIT_THRESHOLD
+
+
+def get_circuit_cooldown():
+    try:
+        return float(os.environ.get("FEDCLOUD_CIRCUIT_COOLDOWN", DEFAULT_CIRCUIT_COOLDOWN))
+    except ValueError:
+        return DEFAULT_CIRCUIT_COOLDOWN
+
+
+def get_circuit_open_time(site):
+    """
+    Time for which the site is skipped
+
+    :param site: site ID in GOCDB
+
+    :return: remaining time in seconds, 0 if the site can be used
+    """
+    threshold = get_circuit_threshold()
+    if threshold <= 0:
+        return 0
+    state = load_entry("circuit", cache_key(site))
+    if not state or state["failures"] < threshold:
+        return 0
+    return max(state["last_failure"] + get_circuit_cooldown() - time.time(), 0)
+
+
+def record_site_failure(site):
+    """
+    Record failure of the site (unreachable or timed out)
+
+    :param site: site ID in GOCDB
+
+    :return: number of failures in a row
+    """
+    key = cache_key(site)
+    now = time.time()
+    # Sites of parallel operations may fail at the same time
+    with file_lock("circuit", key):
+        state = load_entry("circuit", key) or {"failures": 0}
+        state["failures"] += 1
+        state["last_failure"] = now
+        store_entry("circuit", key, state, now + get_circuit_cooldown())
+    return state["failures"]
+
+
+def record_site_success(site):
+    """
+    Forget failures of the site
+
+    :param site: site ID in GOCDB
+
+    :return: None
+    """
+    delete_entry("circuit", cache_key(site))
@@ -1,22 +1,141 @@
+import importlib
+import os
+import sys
+
 import click
+from click.utils import make_default_short_help
 
-from fedcloudclient.sites import site
-from fedcloudclient.checkin import token
-from fedcloudclient.endpoint import endpoint
-from fedcloudclient.openstack import openstack, openstack_int
+# Subcommands are imported only when invoked, so simple commands and --help do not
+# pay for importing requests, PyYAML, defusedxml, etc. needed by other commands.
+# Command name -> (module:attribute, short help shown in "fedcloud --help"). Short help
+# must match the docstring of the command, checked by benchmarks/bench_startup.py
+LAZY_COMMANDS = {
+    "token": ("fedcloudclient.checkin:token", "Token command group for manipulation with tokens"),
+    "endpoint": ("fedcloudclient.endpoint:endpoint", "endpoint command group for interaction with GOCDB and endpoints"),
+    "site": ("fedcloudclient.sites:site", "Site command group for manipulation with site configurations"),
+    "openstack": ("fedcloudclient.openstack:openstack", "Executing Openstack commands on site and VO"),
+    "openstack-int": ("fedcloudclient.openstack:openstack_int", "Interactive Openstack client on site and VO"),
+    "batch": ("fedcloudclient.batch:batch", "Executing Openstack commands from job file on sites and VOs"),
+    "agent": ("fedcloudclient.agent:agent", "Agent command group for managing fedcloud agent"),
+}
 
 
-@click.group()
-def cli():
-    pass
+class LazyGroup(click.Group):
+    """
+    Command group loading subcommands from their modules at the first use
+    """
 
+    def __init__(self, *args, lazy_commands=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lazy_commands = lazy_commands or {}
 
-cli.add_command(token)
-cli.add_command(endpoint)
-cli.add_command(site)
+    def list_commands(self, ctx):
+        return sorted(set(super().list_commands(ctx)) | set(self.lazy_commands))
 
-cli.add_command(openstack)
-cli.add_command(openstack_int)
+    def get_command(self, ctx, cmd_name):
+        if cmd_name not in self.commands and cmd_name in self.lazy_commands:
+            module_name, attribute = self.lazy_commands[cmd_name][0].split(":")
+            command = getattr(importlib.import_module(module_name), attribute)
+            self.add_command(command, cmd_name)
+        return super().get_command(ctx, cmd_name)
 
-if __name__ == "__main__":
+    def format_commands(self, ctx, formatter):
+        # Same as click.MultiCommand.format_commands(), but short help of commands
+        # not loaded yet is taken from LAZY_COMMANDS instead of importing them
+        cmd_names = [cmd_name for cmd_name in self.list_commands(ctx)
+                     if cmd_name not in self.commands or not self.commands[cmd_name].hidden]
+        if not cmd_names:
+            return
+        limit = formatter.width - 6 - max(len(cmd_name) for cmd_name in cmd_names)
+        rows = []
+        for cmd_name in cmd_names:
+            if cmd_name in self.commands:
+                rows.append((cmd_name, self.commands[cmd_name].get_short_help_str(limit)))
+            else:
+                rows.append((cmd_name, make_default_short_help(self.lazy_commands[cmd_name][1], limit)))
+        with formatter.section("Commands"):
+            formatter.write_dl(rows)
+
+
+def start_tracing(ctx, profile, trace_file):
+    """
+    Trace phases of the invoked command, print summary and/or write trace file when it finishes
+
+    :param ctx: click context of the main command
+    :param profile: print summary table of phases to stderr
+    :param trace_file: path to JSON trace file, None for no trace file
+
+    :return: None
+    """
+    from fedcloudclient import trace
+
+    trace.enable_tracing()
+    command_span = trace.span("fedcloud %s" % ctx.invoked_subcommand, "cli")
+    command_span.__enter__()
+
+    def finish_tracing():
+        command_span.__exit__(None, None, None)
+        try:
+            if profile:
+                trace.print_trace_summary()
+            if trace_file:
+                trace.write_chrome_trace(trace_file)
+        finally:
+            # The agent executes more commands in the same process
+            trace.enable_tracing(False)
+            trace.clear_spans()
+
+    ctx.call_on_close(finish_tracing)
+
+
+@click.group(cls=LazyGroup, lazy_commands=LAZY_COMMANDS)
+@click.option(
+    "--profile",
+    help="Print time spent in phases of the command (Check-in, GOCDB, Keystone, ...)",
+    is_flag=True,
+)
+@click.option(
+    "--trace",
+    "trace_file",
+    help="Write phases of the command to JSON trace file in Chrome trace format",
+    envvar="FEDCLOUD_TRACE",
+    metavar="FILE",
+)
+@click.pass_context
+def cli(ctx, profile, trace_file):
+    if profile or trace_file:
+        start_tracing(ctx, profile, trace_file)
+
+
+def agent_socket_exists():
+    """
+    Cheap check if fedcloud agent may be running, so the agent module (socket server,
+    cache, ...) is not imported by every fedcloud command. Socket path is the same as
+    agent.get_agent_socket_path()
+
+    :return: True if the agent socket exists and forwarding is not disabled
+    """
+    if os.environ.get("FEDCLOUD_NO_AGENT"):
+        return False
+    socket_path = os.environ.get("FEDCLOUD_AGENT_SOCKET")
+    if not socket_path:
+        cache_dir = os.environ.get("FEDCLOUD_CACHE_DIR") or os.path.join(os.path.expanduser("~"), ".fedcloud-cache")
+        socket_path = os.path.join(cache_dir, "agent", "agent.sock")
+    return os.path.exists(socket_path)
+
+
+def main():
+    """
+    Entry point of fedcloud CLI. Commands are forwarded to fedcloud agent if it is running
+    """
+    if agent_socket_exists():
+        from fedcloudclient.agent import forward_to_agent
+
+        exit_code = forward_to_agent(sys.argv[1:])
+        if exit_code is not None:
+            sys.exit(exit_code)
     cli()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,12 @@
 from __future__ import print_function
 
+import itertools
 import os
 import re
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 import defusedxml.ElementTree as ET
 
 import click
@@ -11,10 +15,36 @@ from six.moves.urllib import parse
 import requests
 from tabulate import tabulate
 
+from fedcloudclient.cache import cache_key, load_entry, store_entry, delete_entry
 from fedcloudclient.checkin import refresh_access_token, get_access_token, DEFAULT_CHECKIN_URL
+from fedcloudclient.trace import span
+from fedcloudclient.transport import get_remaining_time, get_session
 
 GOCDB_PUBLICURL = "https://goc.egi.eu/gocdbpi/public/"
 
+GOCDB_SITE_LIST_QUERY = {"method": "get_site_list", "certification_status": "Certified"}
+
+# Fields of GOCDB elements used by fedcloud, only these are kept from responses and cached
+GOCDB_SITE_FIELDS = ("NAME",)
+GOCDB_ENDPOINT_FIELDS = ("SITENAME", "URL", "IN_PRODUCTION")
+
+# Time to live of cached GOCDB responses (in seconds), can be changed via FEDCLOUD_GOCDB_CACHE_TTL
+DEFAULT_GOCDB_CACHE_TTL = 3600
+
+# Maximal number of Keystone endpoints queried at the same time
+MAX_KEYSTONE_WORKERS = 8
+
+# Cached scoped tokens are not used if they expire in less than this time (in seconds)
+SCOPED_TOKEN_EXPIRATION_MARGIN = 300
+
+# Unscoped tokens are reused in the process for scoped tokens of other projects
+# on the same site for this time (in seconds), e.g. when running on all VOs
+UNSCOPED_TOKEN_REUSE_TIME = 300
+
+_unscoped_tokens = {}   # (Keystone URL, access token) -> (unscoped token, protocol, monotonic time)
+_unscoped_token_locks = {}
+_unscoped_token_locks_lock = threading.Lock()
+
 EC3_REFRESHTOKEN_TEMPLATE = """
 description refreshtoken (
     kind = 'component' and
@@ -68,28 +98,187 @@ configure front (
 """
 
 
-def get_sites():
+def get_gocdb_cache_ttl():
+    """
+    Time to live of cached GOCDB responses from FEDCLOUD_GOCDB_CACHE_TTL or default
+
+    :return: TTL in seconds
+    """
+    try:
+        return int(os.environ.get("FEDCLOUD_GOCDB_CACHE_TTL", DEFAULT_GOCDB_CACHE_TTL))
+    except ValueError:
+        return DEFAULT_GOCDB_CACHE_TTL
+
+
+def iter_gocdb_records(query, fields, use_cache=True):
+    """
+    Query GOCDB public API and yield records of the returned elements (e.g. SITE,
+    SERVICE_ENDPOINT) while the response is still being downloaded. Only the given
+    fields (attributes or child elements) are kept, and records of successful
+    responses are cached for get_gocdb_cache_ttl() seconds
+
+    :param query: dict of query parameters
+    :param fields: names of attributes or child elements kept in records
+    :param use_cache: use cached records if exist. Default: True
+
+    :return: generator of dicts field -> value
+    """
+    url = get_gocdb_url(query)
+    key = cache_key(url, *fields)
+    if use_cache:
+        with span("GOCDB cache", "gocdb", method=query.get("method")):
+            cached = load_gocdb_records(key)
+        if cached is not None:
+            yield from cached
+            return
+
+    # The span includes processing of yielded records by the consumer
+    with span("GOCDB query", "gocdb", method=query.get("method")) as s, get_session().get(url, stream=True) as r:
+        if r.status_code != requests.codes.ok:
+            print_gocdb_error(r.status_code, r.text)
+            return
+        # Let urllib3 decompress gzip-encoded responses while streaming
+        r.raw.decode_content = True
+        # Only the selected fields are collected for cache, not the XML elements
+        records = []
+        for record in parse_gocdb_records(r.raw, fields):
+            records.append(record)
+            yield record
+        s.set(records=len(records))
+    store_gocdb_records(key, records)
+
+
+def parse_gocdb_records(source, fields):
+    """
+    Parse GOCDB XML response incrementally from file-like object. Each top-level
+    element is discarded as soon as its record is made, so memory does not grow
+    with the size of the response
+
+    :param source: file-like object with XML response
+    :param fields: names of attributes or child elements kept in records
+
+    :return: generator of dicts field -> value
+    """
+    root = None
+    depth = 0
+    for event, element in ET.iterparse(source, events=("start", "end")):
+        if event == "start":
+            if root is None:
+                root = element
+            depth += 1
+            continue
+        depth -= 1
+        if depth == 1:
+            # Single pass over children instead of find() for each field
+            children = {child.tag: child.text for child in element}
+            yield {field: element.attrib.get(field, children.get(field)) for field in fields}
+            root.clear()
+
+
+def get_gocdb_url(query):
+    """
+    URL of GOCDB query. Parameters are sorted, so the URL can be used as cache key
+
+    :param query: dict of query parameters
+    :return: URL
+    """
+    return "?".join([GOCDB_PUBLICURL, parse.urlencode(sorted(query.items()))])
+
+
+def load_gocdb_records(key):
+    """
+    Get cached records of GOCDB response
+
+    :param key: cache key of GOCDB query
+    :return: list of records, None if not cached or expired
+    """
+    if get_gocdb_cache_ttl() <= 0:
+        return None
+    return load_entry("gocdb", key)
+
+
+def store_gocdb_records(key, records):
+    """
+    Store records of successful GOCDB response in cache
+
+    :param key: cache key of GOCDB query
+    :param records: list of records
+
+    :return: None
+    """
+    ttl = get_gocdb_cache_ttl()
+    if ttl > 0:
+        store_entry("gocdb", key, records, time.time() + ttl)
+
+
+def print_gocdb_error(status_code, text):
+    """
+    Print information about failed GOCDB query
+    """
+    print("Something went wrong...")
+    print(status_code)
+    print(text)
+
+
+def filter_endpoints(records, service_type, production, sites):
+    """
+    Make endpoints from records of GOCDB get_service_endpoint response
+
+    :param records: iterable of records with GOCDB_ENDPOINT_FIELDS
+    :param service_type: service type of the query
+    :param production: only endpoints in production
+    :param sites: set of accepted site IDs
+
+    :return: generator of endpoints [site, service type, URL]
+    """
+    for record in records:
+        if production and (record["IN_PRODUCTION"] or "").upper() != "Y":
+            continue
+        if record["SITENAME"] in sites:
+            yield [record["SITENAME"], service_type, record["URL"]]
+
+
+def get_sites(use_cache=True):
     """
     Get list of sites (using GOCDB instead of site configuration)
 
+    :param use_cache: use cached GOCDB response if exists. Default: True
+
     :return: list of site IDs
     """
-    q = {"method": "get_site_list", "certification_status": "Certified"}
-    url = "?".join([GOCDB_PUBLICURL, parse.urlencode(q)])
-    r = requests.get(url)
-    sites = []
-    if r.status_code == 200:
-        root = ET.fromstring(r.text)
-        for s in root:
-            sites.append(s.attrib.get('NAME'))
-    else:
-        print("Something went wrong...")
-        print(r.status_code)
-        print(r.text)
-    return sites
+    return [record["NAME"] for record in iter_gocdb_records(GOCDB_SITE_LIST_QUERY, GOCDB_SITE_FIELDS, use_cache)]
+
+
+def iter_endpoints(service_type, production=True, monitored=True, site=None, use_cache=True):
+    """
+    Searching GOCDB for endpoints according to service types and status, yielding
+    endpoints while GOCDB response is being downloaded
+
+    :param service_type:
+    :param production:
+    :param monitored:
+    :param site: list of sites, None for searching all sites
+    :param use_cache: use cached GOCDB responses if exist. Default: True
+
+    :return: generator of endpoints [site, service type, URL]
+    """
+    q = get_endpoint_query(service_type, monitored, site)
+    records = iter_gocdb_records(q, GOCDB_ENDPOINT_FIELDS, use_cache)
+    if site:
+        yield from filter_endpoints(records, service_type, production, {site})
+        return
+
+    # Site list and endpoints are independent GOCDB queries, so run them concurrently
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        sites_future = executor.submit(get_sites, use_cache)
+        # Start streaming endpoints before waiting for the site list
+        first_record = next(records, None)
+        sites = set(sites_future.result())
+    if first_record is not None:
+        yield from filter_endpoints(itertools.chain([first_record], records), service_type, production, sites)
 
 
-def find_endpoint(service_type, production=True, monitored=True, site=None):
+def find_endpoint(service_type, production=True, monitored=True, site=None, use_cache=True):
     """
     Searching GOCDB for endpoints according to service types and status
 
@@ -97,40 +286,25 @@ def find_endpoint(service_type, production=True, monitored=True, site=None):
     :param production:
     :param monitored:
     :param site: list of sites, None for searching all sites
+    :param use_cache: use cached GOCDB responses if exist. Default: True
 
     :return: list of endpoints
     """
+    return [endpoint for endpoint in iter_endpoints(service_type, production, monitored, site, use_cache)]
+
+
+def get_endpoint_query(service_type, monitored=True, site=None):
+    """
+    GOCDB query for service endpoints
+
+    :return: dict of query parameters
+    """
     q = {"method": "get_service_endpoint", "service_type": service_type}
     if monitored:
         q["monitored"] = "Y"
     if site:
         q["sitename"] = site
-        sites = [site]
-    else:
-        sites = get_sites()
-    url = "?".join([GOCDB_PUBLICURL, parse.urlencode(q)])
-    r = requests.get(url)
-    endpoints = []
-    if r.status_code == 200:
-        root = ET.fromstring(r.text)
-        for sp in root:
-            if production:
-                prod = sp.find("IN_PRODUCTION").text.upper()
-                if prod != "Y":
-                    continue
-            os_url = sp.find("URL").text
-            ep_site = sp.find('SITENAME').text
-            if ep_site not in sites:
-                continue
-            # os_url = urlparse.urlparse(sp.find('URL').text)
-            # sites[sp.find('SITENAME').text] = urlparse.urlunparse(
-            #    (os_url[0], os_url[1], os_url[2], '', '', ''))
-            endpoints.append([sp.find("SITENAME").text, service_type, os_url])
-    else:
-        print("Something went wrong...")
-        print(r.status_code)
-        print(r.text)
-    return endpoints
+    return q
 
 
 def get_keystone_url(os_auth_url, path):
@@ -145,78 +319,297 @@ def get_keystone_url(os_auth_url, path):
     return parse.urlunparse((url[0], url[1], path, url[3], url[4], url[5]))
 
 
-def get_unscoped_token(os_auth_url, access_token):
+def get_unscoped_token(os_auth_url, access_token, protocol=None, session=None):
     """
-    Get an unscoped token, trying various protocol names if needed
+    Get an unscoped token, trying various protocol names if needed.
+    If protocol is given, it is tried first
     """
-    protocols = ["openid", "oidc"]
-    for p in protocols:
+    for p in get_protocol_candidates(protocol):
         try:
-            unscoped_token = retrieve_unscoped_token(os_auth_url, access_token, p)
+            unscoped_token = retrieve_unscoped_token(os_auth_url, access_token, p, session)
             return unscoped_token, p
         except RuntimeError:
             pass
     raise RuntimeError("Unable to get an scoped token")
 
 
-def get_scoped_token(os_auth_url, access_token, project_id):
+def get_protocol_candidates(protocol=None):
+    """
+    Protocol names to try for federated authentication, the given protocol first
+
+    :param protocol: preferred protocol or None
+    :return: list of protocols
+    """
+    protocols = ["openid", "oidc"]
+    if protocol:
+        protocols = [protocol] + [p for p in protocols if p != protocol]
+    return protocols
+
+
+def get_scoped_token(os_auth_url, access_token, project_id, protocol=None):
     """
     Get a scoped token, trying various protocol names if needed
     """
-    unscoped_token, protocol = get_unscoped_token(os_auth_url, access_token)
+    unscoped_token, protocol = get_unscoped_token(os_auth_url, access_token, protocol)
+    scoped_token, _ = retrieve_scoped_token(os_auth_url, unscoped_token, project_id)
+    return scoped_token, protocol
+
+
+def retrieve_scoped_token(os_auth_url, unscoped_token, project_id):
+    """
+    Request a scoped token from unscoped token
+
+    :return: scoped token, expiration timestamp (None if unknown)
+    """
     url = get_keystone_url(os_auth_url, "/v3/auth/tokens")
-    body = {
+    with span("Keystone scoped token", "keystone", url=os_auth_url):
+        r = get_session().post(url, json=get_scoped_token_request(unscoped_token, project_id))
+    if r.status_code != requests.codes.created:
+        raise RuntimeError("Unable to get an scoped token")
+
+    try:
+        token_data = r.json()
+    except ValueError:
+        token_data = None
+    return r.headers["X-Subject-Token"], get_token_expiration(token_data)
+
+
+def get_scoped_token_request(unscoped_token, project_id):
+    """
+    Body of Keystone request for scoped token
+    """
+    return {
         "auth": {
             "identity": {"methods": ["token"], "token": {"id": unscoped_token}},
             "scope": {"project": {"id": project_id}},
         }
     }
-    r = requests.post(url, json=body)
-    if r.status_code != requests.codes.created:
-        raise RuntimeError("Unable to get an scoped token")
-    else:
-        return r.headers["X-Subject-Token"], protocol
 
 
-def retrieve_unscoped_token(os_auth_url, access_token, protocol="openid"):
+def get_token_expiration(token_data):
+    """
+    Get expiration time from Keystone token response
+
+    :param token_data: JSON body of the response
+    :return: expiration timestamp, None if unknown
+    """
+    try:
+        expires_at = token_data["token"]["expires_at"]
+        # Keystone format is e.g. 2021-01-05T10:47:07.000000Z
+        return datetime.strptime(
+            expires_at, "%Y-%m-%dT%H:%M:%S.%fZ"
+        ).replace(tzinfo=timezone.utc).timestamp()
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+def get_token_identity(access_token):
+    """
+    Identity of the owner of access token (issuer and subject), used in cache keys,
+    so new access tokens of the same user can reuse cached scoped tokens
+
+    :param access_token: access token
+    :return: identity string
+    """
+    try:
+        payload = jwt.decode(access_token, verify=False)
+        return "%s %s" % (payload["iss"], payload["sub"])
+    except (jwt.exceptions.InvalidTokenError, KeyError):
+        return cache_key(access_token)
+
+
+def scoped_token_cache_key(site, project_id, access_token):
+    """
+    Key of scoped token in the token cache
+    """
+    return cache_key(site, project_id, get_token_identity(access_token))
+
+
+def get_cached_scoped_token(os_auth_url, access_token, project_id, site, protocol=None):
+    """
+    Get a scoped token from the token cache if a valid one exists, otherwise
+    get new scoped token from Keystone and store it in the cache
+
+    :param os_auth_url: Keystone URL
+    :param access_token: access token
+    :param project_id: project ID
+    :param site: site ID in GOCDB
+    :param protocol: preferred protocol, None for trying all protocols
+
+    :return: scoped token, protocol
+    """
+    key = scoped_token_cache_key(site, project_id, access_token)
+    with span("scoped token cache", "keystone", site=site):
+        cached = load_scoped_token(key)
+    if cached:
+        return cached
+
+    unscoped_token, protocol = get_reusable_unscoped_token(os_auth_url, access_token, protocol)
+    try:
+        scoped_token, expiration_timestamp = retrieve_scoped_token(os_auth_url, unscoped_token, project_id)
+    except RuntimeError:
+        # The unscoped token may have expired or have been revoked
+        _unscoped_tokens.pop((os_auth_url, access_token), None)
+        raise
+    store_scoped_token(key, scoped_token, protocol, expiration_timestamp)
+    return scoped_token, protocol
+
+
+def prune_unscoped_tokens():
+    """
+    Forget unscoped tokens older than UNSCOPED_TOKEN_REUSE_TIME, and locks of sites
+    without valid token that are not in use, so long-running processes (e.g. the agent)
+    do not keep tokens of all access tokens ever used. Called with _unscoped_token_locks_lock
+
+    :return: None
+    """
+    now = time.monotonic()
+    # Note: list() is shadowed by the "endpoint list" command in this module
+    for key in [key for key, cached in _unscoped_tokens.items() if now - cached[2] >= UNSCOPED_TOKEN_REUSE_TIME]:
+        _unscoped_tokens.pop(key, None)
+    for key in [key for key, lock in _unscoped_token_locks.items()
+                if key not in _unscoped_tokens and not lock.locked()]:
+        del _unscoped_token_locks[key]
+
+
+def get_reusable_unscoped_token(os_auth_url, access_token, protocol=None):
+    """
+    Get an unscoped token, reusing the one obtained recently in the process for
+    the same site and access token. Concurrent requests for the same site wait for
+    one authentication, within the deadline of the current thread
+
+    :param os_auth_url: Keystone URL
+    :param access_token: access token
+    :param protocol: preferred protocol, None for trying all protocols
+
+    :return: unscoped token, protocol
+    """
+    key = (os_auth_url, access_token)
+    with _unscoped_token_locks_lock:
+        prune_unscoped_tokens()
+        lock = _unscoped_token_locks.setdefault(key, threading.Lock())
+    remaining_time = get_remaining_time()
+    if not lock.acquire(timeout=-1 if remaining_time is None else max(remaining_time, 0)):
+        raise requests.exceptions.Timeout("Time limit exceeded waiting for authentication on %s" % os_auth_url)
+    try:
+        cached = _unscoped_tokens.get(key)
+        if cached and time.monotonic() - cached[2] < UNSCOPED_TOKEN_REUSE_TIME:
+            return cached[0], cached[1]
+        unscoped_token, protocol = get_unscoped_token(os_auth_url, access_token, protocol)
+        _unscoped_tokens[key] = (unscoped_token, protocol, time.monotonic())
+        return unscoped_token, protocol
+    finally:
+        lock.release()
+
+
+def load_scoped_token(key):
+    """
+    Load valid scoped token from the token cache
+
+    :return: scoped token, protocol or None if not found
+    """
+    cached = load_entry("scoped-tokens", key)
+    if cached:
+        return cached["token"], cached["protocol"]
+    return None
+
+
+def store_scoped_token(key, scoped_token, protocol, expiration_timestamp):
+    """
+    Store scoped token in the token cache, if its expiration time is known
+    """
+    if expiration_timestamp is not None:
+        store_entry("scoped-tokens", key,
+                    {"token": scoped_token, "protocol": protocol},
+                    expiration_timestamp - SCOPED_TOKEN_EXPIRATION_MARGIN)
+
+
+def invalidate_scoped_token(site, project_id, access_token):
+    """
+    Remove scoped token from the token cache, e.g. after it was rejected
+    """
+    delete_entry("scoped-tokens", scoped_token_cache_key(site, project_id, access_token))
+
+
+def retrieve_unscoped_token(os_auth_url, access_token, protocol="openid", session=None):
     """
     Request an unscoped token
     """
-    url = get_keystone_url(
-        os_auth_url,
-        "/v3/OS-FEDERATION/identity_providers/egi.eu/protocols/%s/auth" % protocol,
-    )
-    r = requests.post(url, headers={"Authorization": "Bearer %s" % access_token})
+    url = get_unscoped_token_url(os_auth_url, protocol)
+    with span("Keystone unscoped token", "keystone", url=os_auth_url, protocol=protocol):
+        r = (session or get_session()).post(url, headers={"Authorization": "Bearer %s" % access_token})
     if r.status_code != requests.codes.created:
         raise RuntimeError("Unable to get an unscoped token")
     else:
         return r.headers["X-Subject-Token"]
 
 
-def get_projects(os_auth_url, unscoped_token):
+def get_unscoped_token_url(os_auth_url, protocol):
+    """
+    Keystone URL for federated authentication with the protocol
+    """
+    return get_keystone_url(
+        os_auth_url,
+        "/v3/OS-FEDERATION/identity_providers/egi.eu/protocols/%s/auth" % protocol,
+    )
+
+
+def get_projects(os_auth_url, unscoped_token, session=None):
     """
     Get list of projects from unscoped token
     """
     url = get_keystone_url(os_auth_url, "/v3/auth/projects")
-    r = requests.get(url, headers={"X-Auth-Token": unscoped_token})
+    with span("Keystone projects", "keystone", url=os_auth_url):
+        r = (session or get_session()).get(url, headers={"X-Auth-Token": unscoped_token})
     r.raise_for_status()
     return r.json()["projects"]
 
 
-def get_projects_from_sites(access_token, site):
+def get_projects_from_endpoint(access_token, ep, session=None):
+    """
+    Get all projects from a site endpoint using access token
+
+    :param access_token: access token
+    :param ep: endpoint from find_endpoint() [site, service type, URL]
+    :param session: requests session, None for the shared session
+
+    :return: list of projects [id, name, enabled, site]
     """
-    Get all projects from sites using access token
+    os_auth_url = ep[2]
+    unscoped_token, _ = get_unscoped_token(os_auth_url, access_token, session=session)
+    return [
+        [p["id"], p["name"], p["enabled"], ep[0]]
+        for p in get_projects(os_auth_url, unscoped_token, session)
+    ]
+
+
+def get_projects_from_sites(access_token, site, use_cache=True, errors=None):
     """
+    Get all projects from sites using access token. Sites are queried concurrently
+    over the shared connection pool. Sites with errors are skipped
+
+    :param access_token: access token
+    :param site: site ID, None for all sites
+    :param use_cache: use cached GOCDB responses if exist. Default: True
+    :param errors: if a list is given, [site, error message] of failed sites are appended to it
+
+    :return: list of projects [id, name, enabled, site]
+    """
+    endpoints = find_endpoint("org.openstack.nova", site=site, use_cache=use_cache)
     project_list = []
-    for ep in find_endpoint("org.openstack.nova", site=site):
-        os_auth_url = ep[2]
-        unscoped_token, _ = get_unscoped_token(os_auth_url, access_token)
-        project_list.extend(
-            [
-                [p["id"], p["name"], p["enabled"], ep[0]]
-                for p in get_projects(os_auth_url, unscoped_token)
-            ]
-        )
+    if not endpoints:
+        return project_list
+
+    with ThreadPoolExecutor(max_workers=min(MAX_KEYSTONE_WORKERS, len(endpoints))) as executor:
+        futures = [executor.submit(get_projects_from_endpoint, access_token, ep)
+                   for ep in endpoints]
+        for ep, future in zip(endpoints, futures):
+            try:
+                project_list.extend(future.result())
+            except (RuntimeError, ValueError, KeyError,
+                    requests.exceptions.RequestException) as e:
+                if errors is not None:
+                    errors.append([ep[0], str(e)])
     return project_list
 
 
@@ -277,13 +670,19 @@ def endpoint():
     help="Name of the site",
     envvar="EGI_SITE",
 )
+@click.option(
+    "--no-cache",
+    is_flag=True,
+    help="Do not use cached GOCDB data",
+)
 def projects(
         checkin_client_id,
         checkin_client_secret,
         checkin_refresh_token,
         checkin_access_token,
         checkin_url,
-        site
+        site,
+        no_cache
 ):
     """
     List of all project from specific site/sites
@@ -294,8 +693,12 @@ def projects(
                                     checkin_client_secret,
                                     checkin_url)
 
-    project_list = get_projects_from_sites(access_token, site)
+    errors = []
+    project_list = get_projects_from_sites(access_token, site, not no_cache, errors)
     print(tabulate(project_list, headers=["id", "Name", "enabled", "site"]))
+    if errors:
+        print()
+        print(tabulate(errors, headers=["site", "error"]))
 
 
 @endpoint.command()
@@ -338,6 +741,11 @@ def projects(
     required=True,
     envvar="OS_PROJECT_ID",
 )
+@click.option(
+    "--no-cache",
+    is_flag=True,
+    help="Do not use cached GOCDB data",
+)
 def token(
         checkin_client_id,
         checkin_client_secret,
@@ -346,6 +754,7 @@ def token(
         checkin_url,
         project_id,
         site,
+        no_cache,
 ):
     """
     Get scoped keystone token from site and project ID
@@ -357,9 +766,9 @@ def token(
                                     checkin_url)
     # Getting sites from GOCDB
     # assume first one is ok
-    ep = find_endpoint("org.openstack.nova", site=site).pop()
+    ep = find_endpoint("org.openstack.nova", site=site, use_cache=not no_cache).pop()
     os_auth_url = ep[2]
-    scoped_token, _ = get_scoped_token(os_auth_url, access_token, project_id)
+    scoped_token, _ = get_cached_scoped_token(os_auth_url, access_token, project_id, site)
     print('export OS_TOKEN="%s"' % scoped_token)
 
 
@@ -488,6 +897,11 @@ def ec3_refresh(
     show_default=True,
 )
 @click.option("--force", is_flag=True, help="Force rewrite of files")
+@click.option(
+    "--no-cache",
+    is_flag=True,
+    help="Do not use cached GOCDB data",
+)
 def ec3(
         checkin_client_id,
         checkin_client_secret,
@@ -499,6 +913,7 @@ def ec3(
         auth_file,
         template_dir,
         force,
+        no_cache,
 ):
     if os.path.exists(auth_file) and not force:
         print("Auth file already exists, not replacing unless --force option is included")
@@ -512,7 +927,7 @@ def ec3(
 
     # Get the right endpoint from GOCDB
     # assume first one is ok
-    ep = find_endpoint("org.openstack.nova", site=site).pop()
+    ep = find_endpoint("org.openstack.nova", site=site, use_cache=not no_cache).pop()
     os_auth_url = ep[2]
     site_auth = [
         "id = %s" % site,
@@ -566,11 +981,16 @@ def ec3(
     help="Name of the site",
     envvar="EGI_SITE"
 )
-def list(service_type, production, monitored, site):
+@click.option(
+    "--no-cache",
+    is_flag=True,
+    help="Do not use cached GOCDB data",
+)
+def list(service_type, production, monitored, site, no_cache):
     """
     List of endpoints of site/sites according info in GOCDB
     """
-    endpoints = find_endpoint(service_type, production, monitored, site)
+    endpoints = find_endpoint(service_type, production, monitored, site, not no_cache)
     print(tabulate(endpoints, headers=["Site", "type", "URL"]))
 
 
@@ -614,6 +1034,11 @@ def list(service_type, production, monitored, site):
     required=True,
     envvar="OS_PROJECT_ID",
 )
+@click.option(
+    "--no-cache",
+    is_flag=True,
+    help="Do not use cached GOCDB data",
+)
 def env(
         checkin_client_id,
         checkin_client_secret,
@@ -622,6 +1047,7 @@ def env(
         checkin_url,
         project_id,
         site,
+        no_cache,
 ):
     """
     Generating OS environment variables for specific project/site
@@ -633,9 +1059,9 @@ def env(
                                     checkin_url)
     # Get the right endpoint from GOCDB
     # assume first one is ok
-    ep = find_endpoint("org.openstack.nova", site=site).pop()
+    ep = find_endpoint("org.openstack.nova", site=site, use_cache=not no_cache).pop()
     os_auth_url = ep[2]
-    scoped_token, protocol = get_scoped_token(os_auth_url, access_token, project_id)
+    scoped_token, protocol = get_cached_scoped_token(os_auth_url, access_token, project_id, site)
     print("# environment for %s" % site)
     print('export OS_AUTH_URL="%s"' % os_auth_url)
     print('export OS_AUTH_TYPE="v3oidcaccesstoken"')
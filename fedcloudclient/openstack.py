@@ -1,21 +1,200 @@
+import io
+import itertools
 import json
+import logging
 import os
-from distutils.spawn import find_executable
+import re
+import shutil
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
 import click
+import requests
 
 # Subprocess is required for invoking openstack client, so ignored bandit check
 import subprocess       # nosec
 
-from fedcloudclient.checkin import get_access_token, DEFAULT_CHECKIN_URL
-from fedcloudclient.sites import find_endpoint_and_project_id, list_sites
+from fedcloudclient.aggregate import (
+    AGGREGATED_OUTPUT_FORMATS,
+    filter_rows,
+    get_row_count,
+    merge_site_results,
+    render_table,
+    select_columns,
+    sort_rows,
+)
+from fedcloudclient.checkin import get_access_token, token_list_vos, DEFAULT_CHECKIN_URL
+from fedcloudclient.circuit import get_circuit_open_time, record_site_failure, record_site_success
+from fedcloudclient.endpoint import get_cached_scoped_token, invalidate_scoped_token
+from fedcloudclient.sites import find_endpoint_and_project_id, find_site_vo_pairs, list_sites
+from fedcloudclient.trace import span
+from fedcloudclient.transport import deadline_scope, get_remaining_time
 
 DEFAULT_PROTOCOL = "openid"
 DEFAULT_AUTH_TYPE = "v3oidcaccesstoken"
 DEFAULT_IDENTITY_PROVIDER = "egi.eu"
+SCOPED_TOKEN_AUTH_TYPE = "v3token"
 
 OPENSTACK_CLIENT = "openstack"
 
+# Engines for executing openstack commands: new "openstack" process for each command,
+# or openstackclient shell running inside the current process
+OPENSTACK_ENGINES = ("subprocess", "inprocess")
+DEFAULT_ENGINE = "subprocess"
+
+# Number of sites processed at the same time in multi-site operations
+DEFAULT_PARALLEL = 1
+
+# Output formats of openstack command: human-readable text in the order of sites,
+# one JSON object per line for each site as soon as it finishes, or JSON results
+# of all sites merged into one table (see aggregate.py)
+OUTPUT_FORMATS = ("text", "ndjson") + AGGREGATED_OUTPUT_FORMATS
+DEFAULT_OUTPUT_FORMAT = "text"
+
+# Error codes of sites not processed completely (following timeout(1) and sysexits.h)
+SITE_TIMEOUT = 124
+SITE_UNREACHABLE = 69
+SITE_SKIPPED = 75
+
+# Status of sites in multi-site operations by error code, other non-zero codes are "error"
+SITE_STATUSES = {0: "ok", SITE_TIMEOUT: "timeout", SITE_UNREACHABLE: "unreachable", SITE_SKIPPED: "skipped"}
+
+# Number of retries of Keystone authentication when site is unreachable,
+# and backoff factor between them (1 -> 1s, 2s, 4s, ...)
+DEFAULT_SITE_RETRIES = 0
+SITE_RETRY_BACKOFF_FACTOR = 1.0
+
+# Messages of openstack client when Keystone rejects the token (expired or revoked)
+AUTHENTICATION_ERROR_PATTERN = re.compile(
+    r"HTTP 401|requires authentication|Unauthorized|Failed to validate token|Could not find token"
+    r"|token (has )?expired|token is expired",
+    re.IGNORECASE
+)
+
+# Openstack client shell configures global logging for every run, so only one in-process
+# command can run at a time
+_inprocess_lock = threading.Lock()
+
+
+def run_openstack_subprocess(arguments):
+    """
+    Execute openstack client as subprocess
+
+    :param arguments: command and options for openstack client in tuple
+
+    :return: exit code, stdout, stderr
+    """
+
+    # Calling openstack client as subprocess, caching stdout/stderr
+    # Ignore bandit warning. The client is killed at the deadline of the current thread
+    timeout = get_remaining_time()
+    if timeout is not None and timeout <= 0:
+        return SITE_TIMEOUT, "", "Error: time limit exceeded before starting openstack client\n"
+    try:
+        completed = subprocess.run((OPENSTACK_CLIENT,) + tuple(arguments),   # nosec
+                                   stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        return SITE_TIMEOUT, "", "Error: openstack client killed after %.1f s, time limit exceeded\n" % timeout
+    return completed.returncode, completed.stdout.decode('utf-8'), completed.stderr.decode('utf-8')
+
+
+def run_openstack_inprocess(arguments):
+    """
+    Execute openstack client shell inside the current process. Python startup and loading
+    of openstackclient plugins is paid only once, for the first command
+
+    :param arguments: command and options for openstack client in tuple
+
+    :return: exit code, stdout, stderr
+    """
+    try:
+        from openstackclient import shell as openstack_shell
+    except ImportError:
+        return 1, "", "Error: python-openstackclient is not installed in the current Python environment\n"
+
+    stdout = io.StringIO()
+    stderr = io.StringIO()
+    # The command itself cannot be interrupted, but waiting for other commands is limited
+    # by the deadline of the current thread
+    timeout = get_remaining_time()
+    if not _inprocess_lock.acquire(timeout=-1 if timeout is None else max(timeout, 0)):
+        return SITE_TIMEOUT, "", "Error: time limit exceeded waiting for in-process openstack client\n"
+    try:
+        # openstackclient adds its own logging handlers for every run, restore them afterwards
+        root_logger = logging.getLogger()
+        saved_handlers = root_logger.handlers[:]
+        saved_level = root_logger.level
+        try:
+            shell = make_inprocess_shell(openstack_shell.OpenStackShell, stdout, stderr)
+            try:
+                error_code = shell.run(list(arguments))
+            except SystemExit as e:
+                # argparse exits on invalid options
+                error_code = e.code if isinstance(e.code, int) else 1
+        finally:
+            root_logger.handlers = saved_handlers
+            root_logger.setLevel(saved_level)
+    finally:
+        _inprocess_lock.release()
+    return error_code, stdout.getvalue(), stderr.getvalue()
+
+
+def make_inprocess_shell(shell_class, stdout, stderr):
+    """
+    Create openstack client shell writing to the given streams. Global sys.stdout and
+    sys.stderr are never replaced, as other threads (e.g. printing results of other
+    sites) use them at the same time
+
+    :param shell_class: cliff application class of openstack client
+    :param stdout: stream for output of the command
+    :param stderr: stream for error messages of the command
+
+    :return: shell instance
+    """
+    shell = shell_class()
+    # openstackclient shell does not pass the streams to cliff App.__init__()
+    shell.stdout = stdout
+    shell.stderr = stderr
+
+    def print_message(message, file=None):
+        # argparse of the global options prints help, version and errors to sys.stdout/sys.stderr
+        if message:
+            (stderr if file is sys.stderr else stdout).write(message)
+
+    shell.parser._print_message = print_message
+
+    configure_logging = shell.configure_logging
+
+    def configure_logging_to_stderr():
+        configure_logging()
+        # Console log handler of osc_lib writes error messages to global sys.stderr
+        console_logger = getattr(getattr(shell, "log_configurator", None), "console_logger", None)
+        if isinstance(console_logger, logging.StreamHandler):
+            console_logger.setStream(stderr)
+
+    shell.configure_logging = configure_logging_to_stderr
+    return shell
+
+
+def run_openstack(arguments, engine=DEFAULT_ENGINE):
+    """
+    Execute openstack client command with the given engine
+
+    :param arguments: command and options for openstack client in tuple
+    :param engine: "subprocess" or "inprocess"
+
+    :return: exit code, stdout, stderr
+    """
+    with span("openstack client", "openstack", engine=engine):
+        if engine == "inprocess":
+            return run_openstack_inprocess(arguments)
+        elif engine == "subprocess":
+            return run_openstack_subprocess(arguments)
+        else:
+            raise ValueError("Unknown openstack engine %s" % engine)
+
 
 def fedcloud_openstack_full(
         checkin_access_token,
@@ -25,11 +204,24 @@ def fedcloud_openstack_full(
         site,
         vo,
         openstack_command,
-        json_output=True
+        json_output=True,
+        use_token_cache=True,
+        engine=DEFAULT_ENGINE,
+        retries=DEFAULT_SITE_RETRIES
 ):
     """
     Calling openstack client with full options specified, including support
-    for other identity providers and protocols
+    for other identity providers and protocols.
+
+    If VO is given and default authentication type and identity provider are used,
+    a scoped Keystone token is taken from the token cache (or obtained and cached)
+    and passed to openstack client as --os-token, so the client does not need
+    to repeat the OIDC authentication for every command. If the site cannot be
+    reached during the authentication, the openstack command is not executed.
+
+    Deadline of the current thread set by transport.deadline_scope() limits the
+    authentication and the openstack client (killed at the deadline if executed
+    as subprocess)
 
     :param checkin_access_token: Checkin access token. Passed to openstack client as --os-access-token
     :param checkin_protocol: Checkin protocol (openid, oidc). Passed to openstack client as --os-protocol
@@ -39,8 +231,13 @@ def fedcloud_openstack_full(
     :param vo: VO name
     :param openstack_command: Openstack command in tuple, e.g. ("image", "list", "--long")
     :param json_output: if result is JSON object or string. Default:True
+    :param use_token_cache: use cached scoped token if possible. Default:True
+    :param engine: "subprocess" for calling openstack client as new process,
+        "inprocess" for calling it inside the current process. Default: subprocess
+    :param retries: number of retries of authentication if the site is unreachable. Default: 0
 
-    :return: error code, result or error message
+    :return: error code, result or error message. Error code is SITE_UNREACHABLE if the site
+        could not be reached, SITE_TIMEOUT if the deadline was exceeded
     """
 
     endpoint, project_id, protocol = find_endpoint_and_project_id(site, vo)
@@ -50,29 +247,150 @@ def fedcloud_openstack_full(
     if protocol is None:
         protocol = checkin_protocol
 
-    options = ("--os-auth-url", endpoint,
-               "--os-auth-type", checkin_auth_type,
-               "--os-protocol", protocol,
-               "--os-identity-provider", checkin_identity_provider,
-               "--os-access-token", checkin_access_token
-               )
+    scoped_token = None
+    if use_token_cache and can_use_scoped_token(vo, checkin_auth_type, checkin_identity_provider):
+        try:
+            scoped_token = get_site_scoped_token(endpoint, checkin_access_token, project_id, site,
+                                                 protocol, retries)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            remaining_time = get_remaining_time()
+            if remaining_time is not None and remaining_time <= 0:
+                return SITE_TIMEOUT, "Time limit exceeded during authentication on site %s" % site
+            return SITE_UNREACHABLE, "Site %s unreachable: %s" % (site, e)
 
-    if vo:
+    options = build_openstack_options(
+        checkin_access_token,
+        protocol,
+        checkin_auth_type,
+        checkin_identity_provider,
+        endpoint,
+        project_id,
+        scoped_token,
+        json_output
+    )
+
+    error_code, result_str, error_message = run_openstack(openstack_command + options, engine)
+
+    # The cached token may have been revoked, so do not reuse it after authentication failure
+    if error_code != 0 and scoped_token and is_authentication_error(result_str, error_message):
+        invalidate_scoped_token(site, project_id, checkin_access_token)
+
+    return parse_openstack_output(error_code, result_str, error_message, json_output)
+
+
+def get_site_scoped_token(os_auth_url, access_token, project_id, site, protocol, retries=DEFAULT_SITE_RETRIES):
+    """
+    Get scoped token via the token cache. If the site cannot be reached, authentication
+    is retried with exponential backoff, within the deadline of the current thread
+
+    :param os_auth_url: Keystone URL
+    :param access_token: access token
+    :param project_id: project ID
+    :param site: site ID in GOCDB
+    :param protocol: preferred protocol
+    :param retries: number of retries if the site is unreachable
+
+    :return: scoped token, None if authentication failed (openstack client will report it)
+    :raise requests.exceptions.ConnectionError, requests.exceptions.Timeout: if the site is unreachable
+    """
+    for attempt in range(retries + 1):
+        try:
+            scoped_token, _ = get_cached_scoped_token(os_auth_url, access_token, project_id, site, protocol)
+            return scoped_token
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            delay = SITE_RETRY_BACKOFF_FACTOR * 2 ** attempt
+            remaining_time = get_remaining_time()
+            if attempt == retries or (remaining_time is not None and remaining_time <= delay):
+                raise
+            time.sleep(delay)
+        except (RuntimeError, requests.exceptions.RequestException):
+            # Let openstack client do the authentication and report errors
+            return None
+
+
+def is_authentication_error(result_str, error_message):
+    """
+    Check if openstack client failed because the token was rejected, other errors
+    (e.g. invalid command or missing resource) do not invalidate cached token
+
+    :param result_str: standard output of openstack client
+    :param error_message: standard error output of openstack client
+
+    :return: True if the output reports authentication failure
+    """
+    return AUTHENTICATION_ERROR_PATTERN.search(error_message + result_str) is not None
+
+
+def can_use_scoped_token(vo, checkin_auth_type, checkin_identity_provider):
+    """
+    Check if cached scoped token can be used instead of OIDC authentication of openstack client.
+    Scoped tokens are available only for projects (VO is given) with default authentication
+    type and identity provider
+
+    :return: True if scoped token can be used
+    """
+    return (vo is not None
+            and checkin_auth_type == DEFAULT_AUTH_TYPE
+            and checkin_identity_provider == DEFAULT_IDENTITY_PROVIDER)
+
+
+def build_openstack_options(
+        checkin_access_token,
+        protocol,
+        checkin_auth_type,
+        checkin_identity_provider,
+        endpoint,
+        project_id,
+        scoped_token=None,
+        json_output=True
+):
+    """
+    Build options for openstack client for authentication and output format
+
+    :param checkin_access_token: Checkin access token
+    :param protocol: protocol of the site
+    :param checkin_auth_type: Checkin authentication type
+    :param checkin_identity_provider: Checkin identity provider
+    :param endpoint: Keystone endpoint of the site
+    :param project_id: project ID, None if not using project
+    :param scoped_token: scoped Keystone token, None for authentication via access token
+    :param json_output: if openstack client should return JSON
+
+    :return: options in tuple
+    """
+    if scoped_token:
+        options = ("--os-auth-url", endpoint,
+                   "--os-auth-type", SCOPED_TOKEN_AUTH_TYPE,
+                   "--os-token", scoped_token
+                   )
+    else:
+        options = ("--os-auth-url", endpoint,
+                   "--os-auth-type", checkin_auth_type,
+                   "--os-protocol", protocol,
+                   "--os-identity-provider", checkin_identity_provider,
+                   "--os-access-token", checkin_access_token
+                   )
+
+    if project_id:
         options = options + ("--os-project-id", project_id)
 
     # Output JSON format is useful for further machine processing
     if json_output:
         options = options + ("--format", "json")
+    return options
 
-    # Calling openstack client as subprocess, caching stdout/stderr
-    # Ignore bandit warning
-    completed = subprocess.run((OPENSTACK_CLIENT,) + openstack_command + options,   # nosec
-                               stdout=subprocess.PIPE, stderr=subprocess.PIPE)
 
-    error_code = completed.returncode
-    error_message = completed.stderr.decode('utf-8')
-    result_str = completed.stdout.decode('utf-8')
+def parse_openstack_output(error_code, result_str, error_message, json_output=True):
+    """
+    Make result of fedcloud_openstack_full() from output of openstack client
+
+    :param error_code: exit code of openstack client
+    :param result_str: standard output
+    :param error_message: standard error output
+    :param json_output: if result is JSON object or string
 
+    :return: error code, result or error message
+    """
     if error_code == 0:
         if json_output:
             # Test if openstack command ignore JSON format option
@@ -122,14 +440,281 @@ def fedcloud_openstack(
     )
 
 
-def check_openstack_client_installation():
+def fedcloud_openstack_sites(
+        checkin_access_token,
+        checkin_protocol,
+        checkin_auth_type,
+        checkin_identity_provider,
+        sites,
+        vo,
+        openstack_command,
+        json_output=True,
+        parallel=DEFAULT_PARALLEL,
+        engine=DEFAULT_ENGINE,
+        ordered=True,
+        site_timeout=None,
+        deadline=None,
+        retries=DEFAULT_SITE_RETRIES,
+        circuit_breaker=False
+):
+    """
+    Calling fedcloud_openstack_full() on multiple sites with one VO, see
+    fedcloud_openstack_site_vos() for description of parameters
+
+    :return: generator of tuples (site, error code, result or error message, elapsed time in seconds).
+        Status of sites by error code is in SITE_STATUSES
+    """
+    for site, _, error_code, result, elapsed_time in fedcloud_openstack_site_vos(
+            checkin_access_token,
+            checkin_protocol,
+            checkin_auth_type,
+            checkin_identity_provider,
+            [(site, vo) for site in sites],
+            openstack_command,
+            json_output,
+            parallel,
+            engine,
+            ordered,
+            site_timeout,
+            deadline,
+            retries,
+            circuit_breaker
+    ):
+        yield site, error_code, result, elapsed_time
+
+
+def fedcloud_openstack_site_vos(
+        checkin_access_token,
+        checkin_protocol,
+        checkin_auth_type,
+        checkin_identity_provider,
+        site_vos,
+        openstack_command,
+        json_output=True,
+        parallel=DEFAULT_PARALLEL,
+        engine=DEFAULT_ENGINE,
+        ordered=True,
+        site_timeout=None,
+        deadline=None,
+        retries=DEFAULT_SITE_RETRIES,
+        circuit_breaker=False
+):
+    """
+    Calling fedcloud_openstack_full() on multiple pairs of site and VO, e.g. from
+    sites.find_site_vo_pairs(). If parallel > 1, pairs are processed concurrently by
+    a pool of worker threads (each thread waits for its own openstack subprocess).
+    Results are yielded in the order of pairs, or as soon as each pair finishes if
+    ordered is False. Unscoped Keystone tokens are shared by pairs of the same site,
+    so each site is authenticated only once
+
+    Processing of each pair can be limited by site_timeout, and the whole operation by
+    deadline: HTTP requests of the pair are limited by the remaining time and openstack
+    client (subprocess engine) is killed when the time is over. Pairs not started before
+    the deadline, and sites skipped by the circuit breaker (see circuit.py), are returned
+    with error code SITE_SKIPPED, so results of the other pairs are still available
+
+    :param checkin_access_token: Checkin access token. Passed to openstack client as --os-access-token
+    :param checkin_protocol: Checkin protocol (openid, oidc). Passed to openstack client as --os-protocol
+    :param checkin_auth_type: Checkin authentication type (v3oidcaccesstoken). Passed to openstack client as --os-auth-type
+    :param checkin_identity_provider: Checkin identity provider in mapping (egi.eu). Passed to openstack client as --os-identity-provider
+    :param site_vos: list of tuples (site ID in GOCDB, VO name)
+    :param openstack_command: Openstack command in tuple, e.g. ("image", "list", "--long")
+    :param json_output: if result is JSON object or string. Default:True
+    :param parallel: maximal number of pairs processed at the same time. Default: 1 (sequential)
+    :param engine: "subprocess" or "inprocess", see fedcloud_openstack_full(). Commands of
+        the in-process engine are serialized, so parallel has effect only on authentication
+    :param ordered: if True, results are yielded in the order of pairs, otherwise in the
+        order of completion. Default: True
+    :param site_timeout: maximal time for processing one pair in seconds, None for no limit.
+        Not supported by the in-process engine
+    :param deadline: maximal time of the whole operation in seconds, None for no limit.
+        Not supported by the in-process engine
+    :param retries: number of retries of authentication if a site is unreachable. Default: 0
+    :param circuit_breaker: skip sites that failed repeatedly in the recent past, and record
+        failures and successes of sites. Only unreachable sites and sites exceeding site_timeout
+        are failures, sites stopped by the deadline of the operation are not. Default: False
+
+    :return: generator of tuples (site, VO, error code, result or error message, elapsed time in seconds).
+        Status of pairs by error code is in SITE_STATUSES
+    :raise ValueError: if site_timeout or deadline is used with the in-process engine
     """
-    Check if openstack command-line client is installed and available via $PATH
+    check_time_limits(engine, site_timeout, deadline)
+    operation_deadline = None if deadline is None else time.monotonic() + deadline
+
+    def process_site(site, vo):
+        if operation_deadline is not None and time.monotonic() >= operation_deadline:
+            return SITE_SKIPPED, "Skipped, deadline of the operation (%g s) exceeded" % deadline
+        if circuit_breaker:
+            open_time = get_circuit_open_time(site)
+            if open_time > 0:
+                return SITE_SKIPPED, ("Skipped, site failed repeatedly in the recent past (next try in %.0f s)"
+                                      % open_time)
+
+        site_deadline = operation_deadline
+        # Timeout is a failure of the site only if its own time limit was the binding one
+        site_limited = False
+        if site_timeout is not None:
+            site_deadline = time.monotonic() + site_timeout
+            site_limited = operation_deadline is None or site_deadline < operation_deadline
+            if not site_limited:
+                site_deadline = operation_deadline
+        with deadline_scope(site_deadline):
+            error_code, result = fedcloud_openstack_full(
+                checkin_access_token,
+                checkin_protocol,
+                checkin_auth_type,
+                checkin_identity_provider,
+                site,
+                vo,
+                openstack_command,
+                json_output,
+                engine=engine,
+                retries=retries
+            )
+
+        if circuit_breaker:
+            if error_code == SITE_UNREACHABLE or (error_code == SITE_TIMEOUT and site_limited):
+                record_site_failure(site)
+            elif error_code != SITE_TIMEOUT:
+                record_site_success(site)
+        return error_code, result
+
+    def run_on_site(site_vo):
+        site, vo = site_vo
+        start_time = time.perf_counter()
+        with span("openstack on site", "openstack", site=site, vo=vo):
+            error_code, result = process_site(site, vo)
+        return site, vo, error_code, result, time.perf_counter() - start_time
+
+    if parallel <= 1 or len(site_vos) <= 1:
+        for site_vo in site_vos:
+            yield run_on_site(site_vo)
+        return
+
+    workers = min(parallel, len(site_vos))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        if ordered:
+            # executor.map() keeps the order of pairs regardless of completion order
+            yield from executor.map(run_on_site, site_vos)
+            return
+
+        # Only "workers" pairs are submitted at a time, so results are not piling up
+        # in finished futures when the consumer is slower than the sites
+        remaining_site_vos = iter(site_vos)
+        pending = {executor.submit(run_on_site, site_vo)
+                   for site_vo in itertools.islice(remaining_site_vos, workers)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+            for site_vo in itertools.islice(remaining_site_vos, len(done)):
+                pending.add(executor.submit(run_on_site, site_vo))
+
+
+def check_time_limits(engine, site_timeout, deadline):
+    """
+    Check if time limits can be enforced by the engine. The in-process openstack client
+    cannot be interrupted and its HTTP requests are not limited by the deadline, so
+    a hanging site would block all other sites regardless of the limits
+
+    :param engine: "subprocess" or "inprocess"
+    :param site_timeout: maximal time for processing one site, None for no limit
+    :param deadline: maximal time of the whole operation, None for no limit
+
+    :return: None
+    :raise ValueError: if the limits cannot be enforced
+    """
+    if engine == "inprocess" and (site_timeout is not None or deadline is not None):
+        raise ValueError("Site timeout and deadline cannot be enforced with the in-process engine, "
+                         "use the subprocess engine")
+
+
+def get_site_status(error_code):
+    """
+    Status of site in multi-site operation: ok, error, timeout, unreachable or skipped
+
+    :param error_code: error code of the site
+
+    :return: status
+    """
+    return SITE_STATUSES.get(error_code, "error")
+
+
+def print_openstack_ndjson(site_vo_results, file=None):
+    """
+    Print results of fedcloud_openstack_site_vos() as newline-delimited JSON, one line
+    per site and VO, flushed immediately so consumers can process results incrementally.
+    The output stream is taken before the sites are started, so records are never
+    written into output captured from commands running at the same time
+
+    :param site_vo_results: iterable of tuples (site, VO, error code, result, elapsed time)
+    :param file: output stream, default stdout
+
+    :return: None
+    """
+    file = file or sys.stdout
+    for site, vo, error_code, result, elapsed_time in site_vo_results:
+        record = {
+            "site": site,
+            "vo": vo,
+            "status": get_site_status(error_code),
+            "error_code": error_code,
+            "elapsed": round(elapsed_time, 3),
+        }
+        if error_code == 0:
+            record["result"] = result
+        else:
+            record["error"] = result
+        file.write(json.dumps(record) + "\n")
+        file.flush()
+
+
+def print_aggregated_results(site_vo_results, output_format, sort_by=(), filters=(), columns=None):
+    """
+    Print JSON results of fedcloud_openstack_site_vos() merged into one table, errors of
+    sites are printed to stderr
+
+    :param site_vo_results: iterable of tuples (site, VO, error code, result, elapsed time)
+    :param output_format: "table", "csv" or "json"
+    :param sort_by: list of columns for sorting, -COLUMN for descending order
+    :param filters: list of filter expressions COLUMN<operator>VALUE
+    :param columns: comma-separated columns for output, None for all columns
+
+    :return: None
+    """
+    table, errors = merge_site_results(site_vo_results)
+    if get_row_count(table) > 0:
+        try:
+            rows = sort_rows(table, sort_by, filter_rows(table, filters))
+            selected_columns = select_columns(table, columns.split(",") if columns else None)
+        except (ValueError, re.error) as e:
+            raise SystemExit("Error: %s" % e)
+    else:
+        # Columns are not known without results
+        rows, selected_columns = [], list(table)
+    print(render_table(table, rows, selected_columns, output_format))
+    for site, vo, error_code, message in errors:
+        print("Site: %s, VO: %s, status: %s, error code: %d: %s"
+              % (site, vo, get_site_status(error_code), error_code, message), file=sys.stderr)
+
+
+def check_openstack_client_installation(engine=DEFAULT_ENGINE):
+    """
+    Check if openstack command-line client is installed and available via $PATH,
+    or importable for the in-process engine
+
+    :param engine: "subprocess" or "inprocess"
 
     :return: True if available
     """
 
-    return find_executable(OPENSTACK_CLIENT) is not None
+    if engine == "inprocess":
+        try:
+            import openstackclient.shell    # noqa: F401
+        except ImportError:
+            return False
+        return True
+    return shutil.which(OPENSTACK_CLIENT) is not None
 
 
 @click.command(context_settings={"ignore_unknown_options": True})
@@ -189,9 +774,76 @@ def check_openstack_client_installation():
 )
 @click.option(
     "--vo",
-    help="Name of the VO",
+    help="Name of the VO, ALL_VOS for all VOs of the user supported by the sites",
     envvar="EGI_VO",
 )
+@click.option(
+    "--parallel",
+    help="Number of sites and VOs processed in parallel (for ALL_SITES and ALL_VOS)",
+    type=click.IntRange(min=1),
+    envvar="FEDCLOUD_PARALLEL",
+    default=DEFAULT_PARALLEL,
+    show_default=True,
+)
+@click.option(
+    "--engine",
+    help="Run openstack client as subprocess or inside fedcloud process",
+    type=click.Choice(OPENSTACK_ENGINES),
+    envvar="FEDCLOUD_ENGINE",
+    default=DEFAULT_ENGINE,
+    show_default=True,
+)
+@click.option(
+    "--output",
+    help="Output format, ndjson prints one JSON object per site as soon as the site finishes, "
+         "table, csv and json merge results of all sites into one table",
+    type=click.Choice(OUTPUT_FORMATS),
+    envvar="FEDCLOUD_OUTPUT",
+    default=DEFAULT_OUTPUT_FORMAT,
+    show_default=True,
+)
+@click.option(
+    "--site-timeout",
+    help="Maximal time for processing one site in seconds",
+    type=click.FloatRange(min=0),
+    envvar="FEDCLOUD_SITE_TIMEOUT",
+)
+@click.option(
+    "--deadline",
+    help="Maximal time of the whole operation in seconds, sites not finished in time are reported",
+    type=click.FloatRange(min=0),
+    envvar="FEDCLOUD_DEADLINE",
+)
+@click.option(
+    "--retries",
+    help="Number of retries of authentication on unreachable sites",
+    type=click.IntRange(min=0),
+    envvar="FEDCLOUD_SITE_RETRIES",
+    default=DEFAULT_SITE_RETRIES,
+    show_default=True,
+)
+@click.option(
+    "--circuit-breaker",
+    help="Skip sites that timed out or were unreachable repeatedly in the recent past (multi-site operations)",
+    is_flag=True,
+    envvar="FEDCLOUD_CIRCUIT_BREAKER",
+)
+@click.option(
+    "--sort-by",
+    help="Sort merged results by column, -COLUMN for descending order (table, csv, json output, repeatable)",
+    multiple=True,
+)
+@click.option(
+    "--filter",
+    "filters",
+    help="Select merged results by COLUMN<operator>VALUE, operators = != < <= > >= ~ (table, csv, json output, "
+         "repeatable)",
+    multiple=True,
+)
+@click.option(
+    "--columns",
+    help="Comma-separated columns of merged results (table, csv, json output)",
+)
 @click.argument(
     "openstack_command",
     required=True,
@@ -208,13 +860,32 @@ def openstack(
         checkin_provider,
         site,
         vo,
+        parallel,
+        engine,
+        output,
+        site_timeout,
+        deadline,
+        retries,
+        circuit_breaker,
+        sort_by,
+        filters,
+        columns,
         openstack_command
 ):
     """
     Executing Openstack commands on site and VO
     """
 
-    if not check_openstack_client_installation():
+    try:
+        check_time_limits(engine, site_timeout, deadline)
+    except ValueError:
+        raise SystemExit("Error: --site-timeout and --deadline cannot be used with --engine inprocess")
+
+    if (sort_by or filters or columns) and output not in AGGREGATED_OUTPUT_FORMATS:
+        raise SystemExit("Error: --sort-by, --filter and --columns require --output %s"
+                         % "/".join(AGGREGATED_OUTPUT_FORMATS))
+
+    if not check_openstack_client_installation(engine):
         print("Error: Openstack command-line client \"openstack\" not found")
         exit(1)
 
@@ -228,23 +899,101 @@ def openstack(
         sites = list_sites()
     else:
         sites = [site]
-    for current_site in sites:
-        print("Site: %s, VO: %s" % (current_site, vo))
-        error_code, result = fedcloud_openstack_full(
+
+    if vo == "ALL_VOS":
+        try:
+            vos = token_list_vos(access_token, checkin_url)
+        except requests.exceptions.RequestException as e:
+            raise SystemExit("Error: Unable to get VO memberships from Check-in: %s" % e)
+        # VO memberships and site configurations are matched once, pairs of VOs
+        # not supported by sites would only fail
+        site_vos = find_site_vo_pairs(sites, vos)
+        if not site_vos:
+            raise SystemExit("Error: None of your VOs (%s) is supported by the site(s)" % ", ".join(vos))
+    else:
+        site_vos = [(current_site, vo) for current_site in sites]
+
+    # Sites failing repeatedly are skipped only in multi-site operations
+    circuit_breaker = circuit_breaker and len(site_vos) > 1
+
+    if output in AGGREGATED_OUTPUT_FORMATS:
+        site_vo_results = fedcloud_openstack_site_vos(
             access_token,
             checkin_protocol,
             checkin_auth_type,
             checkin_provider,
-            current_site,
-            vo,
+            site_vos,
             openstack_command,
-            False  # No JSON output in shell mode
+            True,
+            parallel,
+            engine,
+            site_timeout=site_timeout,
+            deadline=deadline,
+            retries=retries,
+            circuit_breaker=circuit_breaker
         )
+        print_aggregated_results(site_vo_results, output, sort_by, filters, columns)
+        return
+
+    if output == "ndjson":
+        print_openstack_ndjson(
+            fedcloud_openstack_site_vos(
+                access_token,
+                checkin_protocol,
+                checkin_auth_type,
+                checkin_provider,
+                site_vos,
+                openstack_command,
+                True,
+                parallel,
+                engine,
+                ordered=False,
+                site_timeout=site_timeout,
+                deadline=deadline,
+                retries=retries,
+                circuit_breaker=circuit_breaker
+            )
+        )
+        return
+
+    start_time = time.perf_counter()
+    total_site_time = 0.0
+    status_counts = {}
+    # Each site is printed as one block to the stream taken before the sites are started
+    output = sys.stdout
+    for current_site, current_vo, error_code, result, elapsed_time in fedcloud_openstack_site_vos(
+            access_token,
+            checkin_protocol,
+            checkin_auth_type,
+            checkin_provider,
+            site_vos,
+            openstack_command,
+            False,  # No JSON output in shell mode
+            parallel,
+            engine,
+            site_timeout=site_timeout,
+            deadline=deadline,
+            retries=retries,
+            circuit_breaker=circuit_breaker
+    ):
+        total_site_time += elapsed_time
+        status = get_site_status(error_code)
+        status_counts[status] = status_counts.get(status, 0) + 1
+        block = "Site: %s, VO: %s\n" % (current_site, current_vo)
         if error_code != 0:
-            print("Error code: ", error_code)
-            print("Error message: ", result)
+            block += "Error code:  %s\nError message:  %s\n" % (error_code, result)
         else:
-            print(result)
+            block += "%s\n" % result
+        output.write(block)
+        output.flush()
+
+    # Summary goes to stderr, so stdout contains only results of sites
+    if len(site_vos) > 1:
+        print("Total time: %.2f s (sum of per-site times: %.2f s, parallel: %d)"
+              % (time.perf_counter() - start_time, total_site_time, parallel), file=sys.stderr)
+        print("Sites: " + ", ".join("%d %s" % (status_counts[status], status)
+                                    for status in ("ok", "error", "timeout", "unreachable", "skipped")
+                                    if status in status_counts), file=sys.stderr)
 
 
 @click.command()
@@ -1,10 +1,36 @@
-from pathlib import Path
-from urllib.request import urlopen, Request
+import hashlib
+import json
+import os
+import tarfile
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path, PurePosixPath
 
 import click
+import requests
 import yaml
 
-# Default site configs from GitHub
+from fedcloudclient.cache import cache_key, load_entry, store_entry
+from fedcloudclient.trace import span
+from fedcloudclient.transport import get_session
+
+# Listing of site configs in GitHub repository (GitHub contents API), the site configs are
+# discovered from it. Can be changed via FEDCLOUD_SITE_CONFIG_LISTING, e.g. for local copy
+SITE_CONFIG_LISTING_URL = ("https://api.github.com/repos/EGI-Foundation/fedcloud-catchall-operations/"
+                           "contents/sites?ref=master")
+
+# All site configs in one tar.gz archive of the GitHub repository, the site configs are YAML
+# files in directory SITE_CONFIG_BUNDLE_DIR. Can be changed via FEDCLOUD_SITE_CONFIG_BUNDLE,
+# empty value disables the bundle, so the site configs are downloaded one by one
+SITE_CONFIG_BUNDLE_URL = ("https://codeload.github.com/EGI-Foundation/fedcloud-catchall-operations/"
+                          "tar.gz/refs/heads/master")
+SITE_CONFIG_BUNDLE_DIR = "sites"
+
+# Larger files in the bundle are not site configs
+MAX_SITE_CONFIG_SIZE = 1024 * 1024
+
+# Default site configs from GitHub, used if the listing is not available
 DEFAULT_SITE_CONFIGS = (
     "https://raw.githubusercontent.com/EGI-Foundation/fedcloud-catchall-operations/master/sites/100IT.yaml",
     "https://raw.githubusercontent.com/EGI-Foundation/fedcloud-catchall-operations/master/sites/BIFI.yaml",
@@ -32,8 +58,34 @@ DEFAULT_SITE_CONFIGS = (
 
 LOCAL_CONFIG_DIR = ".fedcloud-site-config/"
 
+# Pre-parsed site configurations in local config dir, valid while the YAML files are not changed
+SITE_CONFIG_SNAPSHOT = ".site-config-snapshot.json"
+SITE_CONFIG_SNAPSHOT_VERSION = 1
+
+# Maximal number of site configurations downloaded at the same time
+MAX_DOWNLOAD_WORKERS = 8
+
+# Names of site config files saved from the listing to local config dir, other YAML
+# files in the dir (e.g. added by the user) are never deleted by synchronization
+SITE_CONFIG_SYNC_STATE = ".site-config-sync.json"
+
 site_config_data = []
 
+# Indexes over site_config_data, built by build_site_index() when site configurations are loaded
+site_index = {}         # site ID -> site configuration
+site_vo_index = {}      # (site ID, VO) -> (endpoint, project ID, protocol)
+vo_index = {}           # VO -> list of site IDs
+# Number of site configurations the indexes were built from, -1 if invalidated
+_indexed_site_count = -1
+
+# Source of site configurations in site_config_data: "config_dir" and "signatures" of
+# its YAML files if read from local dir, "loaded_at" (time.monotonic()) if read from GitHub.
+# Used for reloading outdated site configurations in long-running processes (agent)
+_site_config_source = {}
+
+# Site configurations read from GitHub are reloaded after this time in long-running processes
+DEFAULT_SITE_CONFIG_RELOAD_TIME = 3600
+
 
 def read_site_config():
     """
@@ -44,38 +96,297 @@ def read_site_config():
     :return: None
     """
     if len(site_config_data) > 0:
+        # Site configurations may be modified directly by library users, entries added
+        # or removed are detected here, replaced entries via invalidate_site_index()
+        if _indexed_site_count != len(site_config_data):
+            build_site_index()
         return
     config_dir = Path.home() / LOCAL_CONFIG_DIR
-    if config_dir.exists():
-        read_local_site_config(config_dir)
-    else:
-        read_default_site_config()
+    with span("site config load", "site-config") as s:
+        if config_dir.exists():
+            s.set(source="local")
+            read_local_site_config(config_dir)
+        else:
+            s.set(source="default")
+            read_default_site_config()
 
 
-def read_default_site_config():
+def build_site_index():
     """
-    Read default site configurations from GitHub.  Storing
-    site configurations in a global variable, that will be used by other functions
+    Build indexes for fast lookup of sites and VOs from site configurations in global variable.
+    If a site or VO is defined more than once, the first definition is used
 
     :return: None
     """
-    site_config_data.clear()
-    for filename in DEFAULT_SITE_CONFIGS:
-        if filename.lower().startswith('http'):
-            req = Request(filename)
-        else:
-            raise ValueError from None
+    global _indexed_site_count
+    site_index.clear()
+    site_vo_index.clear()
+    vo_index.clear()
+    for site_info in site_config_data:
+        site_name = site_info["gocdb"]
+        if site_name in site_index:
+            continue
+        site_index[site_name] = site_info
+        protocol = site_info.get("protocol")
+        for vo_info in site_info.get("vos") or []:
+            key = (site_name, vo_info["name"])
+            if key in site_vo_index:
+                continue
+            site_vo_index[key] = (site_info["endpoint"], vo_info["auth"]["project_id"], protocol)
+            vo_index.setdefault(vo_info["name"], []).append(site_name)
+    _indexed_site_count = len(site_config_data)
+
+
+def invalidate_site_index():
+    """
+    Mark the indexes as outdated, so they are rebuilt by the next read_site_config().
+    To be called by library users after replacing entries of site_config_data
 
-        # URLs already checked, so ignore bandit test
-        with urlopen(req) as yaml_file:       # nosec
-            site_info = yaml.safe_load(yaml_file)
-            site_config_data.append(site_info)
+    :return: None
+    """
+    global _indexed_site_count
+    _indexed_site_count = -1
+
+
+def download_site_config(url, session=None, sha=None):
+    """
+    Download site configuration from URL. The last downloaded copy is kept in cache and
+    revalidated via ETag/Last-Modified, so unchanged files are not downloaded again.
+    If git blob SHA of the file is known from the listing, the cached copy with the
+    same SHA is used without any request
+
+    :param url: URL of site configuration
+    :param session: requests session, None for the shared session
+    :param sha: git blob SHA of the file, None if not known
+
+    :return: content of site configuration, number of bytes transferred
+    """
+    if not url.lower().startswith('http'):
+        raise ValueError("Invalid URL of site configuration %s" % url)
+
+    key = cache_key(url)
+    cached = load_entry("site-configs", key)
+    if cached and sha is not None and cached.get("sha") == sha:
+        return cached["content"], 0
+    headers = {}
+    if cached:
+        if cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        if cached.get("last_modified"):
+            headers["If-Modified-Since"] = cached["last_modified"]
+
+    with span("site config download", "site-config", url=url) as s:
+        r = (session or get_session()).get(url, headers=headers)
+        s.set(status=r.status_code)
+    if r.status_code == requests.codes.not_modified and cached:
+        return cached["content"], 0
+    r.raise_for_status()
+
+    # Site configurations and the listing are UTF-8, regardless of content type
+    r.encoding = "utf-8"
+    store_entry("site-configs", key, {
+        "etag": r.headers.get("ETag"),
+        "last_modified": r.headers.get("Last-Modified"),
+        "sha": get_git_blob_sha(r.content),
+        "content": r.text,
+    })
+    return r.text, len(r.content)
+
+
+def get_git_blob_sha(content):
+    """
+    Git blob SHA-1 of file content, as given for files in the listing by GitHub contents API
+
+    :param content: file content in bytes
+
+    :return: SHA in hex
+    """
+    return hashlib.sha1(b"blob %d\0" % len(content) + content).hexdigest()  # nosec
+
+
+def get_site_config_listing_url():
+    return os.environ.get("FEDCLOUD_SITE_CONFIG_LISTING", SITE_CONFIG_LISTING_URL)
+
+
+def parse_site_config_listing(content):
+    """
+    Parse listing of site configurations in the format of GitHub contents API
+
+    :param content: JSON listing, list of objects with type, name, sha and download_url
+
+    :return: list of dicts with "name", "url" and "sha" of site configuration files
+    :raise ValueError: if the listing is invalid or does not contain any site configuration
+    """
+    files = []
+    for entry in json.loads(content):
+        name = entry.get("name") or ""
+        # Only plain file names, the names are used in local config dir
+        if entry.get("type") != "file" or not name.endswith(".yaml") or Path(name).name != name:
+            continue
+        files.append({"name": name, "url": entry["download_url"], "sha": entry.get("sha")})
+    if not files:
+        raise ValueError("No site configurations found in listing")
+    return files
+
+
+def list_site_config_files(session=None):
+    """
+    Discover site configuration files from the listing (SITE_CONFIG_LISTING_URL).
+    The listing is revalidated via ETag like site configurations. If it is not
+    available, DEFAULT_SITE_CONFIGS are used instead
+
+    :param session: requests session, None for the shared session
+
+    :return: list of dicts with "name", "url" and "sha" (None if unknown) of site configuration
+        files, True if the files were discovered from the listing
+    """
+    url = get_site_config_listing_url()
+    try:
+        with span("site config listing", "site-config", url=url):
+            content, _ = download_site_config(url, session)
+            return parse_site_config_listing(content), True
+    except (requests.exceptions.RequestException, ValueError, KeyError, TypeError, AttributeError):
+        files = [{"name": config_url.rsplit("/", 1)[-1], "url": config_url, "sha": None}
+                 for config_url in DEFAULT_SITE_CONFIGS]
+        return files, False
+
+
+def download_site_config_files(files):
+    """
+    Download site configuration files concurrently via pooled connections
+
+    :param files: list of files from list_site_config_files()
+
+    :return: list of tuples (content, number of bytes transferred) in the order of files
+    """
+    if not files:
+        return []
+    with ThreadPoolExecutor(max_workers=MAX_DOWNLOAD_WORKERS) as executor:
+        # Note: list() is shadowed by the "site list" command in this module
+        return [download for download in executor.map(
+            lambda f: download_site_config(f["url"], sha=f["sha"]), files)]
+
+
+def get_site_config_bundle_url():
+    return os.environ.get("FEDCLOUD_SITE_CONFIG_BUNDLE", SITE_CONFIG_BUNDLE_URL)
+
+
+def read_site_config_bundle(stream):
+    """
+    Unpack site configurations from tar.gz stream while it is being read. Only YAML files
+    in directory SITE_CONFIG_BUNDLE_DIR (at any level) are used, nothing is written to disk
+
+    :param stream: file-like object with tar.gz content
+
+    :return: dict file name -> content of site configuration
+    """
+    files = {}
+    with tarfile.open(fileobj=stream, mode="r|gz") as tar:
+        for member in tar:
+            path = PurePosixPath(member.name)
+            if (not member.isfile() or path.suffix != ".yaml" or path.parent.name != SITE_CONFIG_BUNDLE_DIR
+                    or member.size > MAX_SITE_CONFIG_SIZE):
+                continue
+            files[path.name] = tar.extractfile(member).read().decode("utf-8")
+    return files
+
+
+def download_site_config_bundle(url, session=None):
+    """
+    Download all site configurations in one tar.gz bundle. The bundle is unpacked while
+    it is streamed, unpacked site configurations are kept in cache and revalidated via
+    ETag/Last-Modified, so unchanged bundle is not downloaded again
+
+    :param url: URL of the bundle
+    :param session: requests session, None for the shared session
+
+    :return: dict file name -> content of site configuration, number of bytes transferred
+    :raise requests.exceptions.RequestException, tarfile.TarError, ValueError: if the bundle
+        cannot be downloaded or unpacked
+    """
+    if not url.lower().startswith('http'):
+        raise ValueError("Invalid URL of site configuration bundle %s" % url)
+
+    key = cache_key(url)
+    cached = load_entry("site-config-bundles", key)
+    headers = {}
+    if cached:
+        if cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        if cached.get("last_modified"):
+            headers["If-Modified-Since"] = cached["last_modified"]
+
+    with span("site config bundle download", "site-config", url=url) as s:
+        with (session or get_session()).get(url, headers=headers, stream=True) as r:
+            s.set(status=r.status_code)
+            if r.status_code == requests.codes.not_modified and cached:
+                return cached["files"], 0
+            r.raise_for_status()
+            files = read_site_config_bundle(r.raw)
+            bytes_transferred = r.raw.tell()
+    if not files:
+        raise ValueError("No site configurations found in bundle %s" % url)
+
+    store_entry("site-config-bundles", key, {
+        "etag": r.headers.get("ETag"),
+        "last_modified": r.headers.get("Last-Modified"),
+        "files": files,
+    })
+    return files, bytes_transferred
+
+
+def get_site_config_bundle(session=None):
+    """
+    Get all site configurations from the bundle (SITE_CONFIG_BUNDLE_URL)
+
+    :param session: requests session, None for the shared session
+
+    :return: dict file name -> content of site configuration, number of bytes transferred,
+        or None if the bundle is disabled or not available
+    """
+    url = get_site_config_bundle_url()
+    if not url:
+        return None
+    try:
+        return download_site_config_bundle(url, session)
+    except (OSError, EOFError, tarfile.TarError, ValueError):
+        # Including requests.exceptions.RequestException, site configs are downloaded one by one instead
+        return None
+
+
+def read_default_site_config():
+    """
+    Read default site configurations from GitHub: from the bundle in one request if available,
+    otherwise the files discovered via the listing are downloaded concurrently via pooled
+    connections. Storing site configurations in a global variable, that will be used by
+    other functions.
+
+    :return: number of bytes transferred
+    """
+    bundle = get_site_config_bundle()
+    if bundle is not None:
+        files, bytes_transferred = bundle
+        contents = [files[name] for name in sorted(files)]
+    else:
+        files, _ = list_site_config_files()
+        downloads = download_site_config_files(files)
+        contents = [content for content, _ in downloads]
+        bytes_transferred = sum(size for _, size in downloads)
+
+    site_config_data.clear()
+    for content in contents:
+        site_config_data.append(yaml.safe_load(content))
+    build_site_index()
+    _site_config_source.clear()
+    _site_config_source["loaded_at"] = time.monotonic()
+    return bytes_transferred
 
 
 def read_local_site_config(config_dir):
     """
     Read site configurations from local directory specified in config_dir. Storing
-    site configurations in global variable, that will be used by other functions
+    site configurations in global variable, that will be used by other functions.
+    Pre-parsed snapshot is used if the YAML files have not been changed since it was written
 
     :param config_dir: path to directory containing site configuration
 
@@ -83,26 +394,230 @@ def read_local_site_config(config_dir):
     """
     site_config_data.clear()
     config_dir = Path(config_dir)
-    for f in sorted(config_dir.glob('*.yaml')):
-        yaml_file = f.open()
-        site_info = yaml.safe_load(yaml_file)
-        site_config_data.append(site_info)
+    config_files = sorted(config_dir.glob('*.yaml'))
+    signatures = get_config_file_signatures(config_files)
 
+    snapshot = read_site_config_snapshot(config_dir, signatures)
+    if snapshot is not None:
+        site_config_data.extend(snapshot)
+    else:
+        for f in config_files:
+            with f.open() as yaml_file:
+                site_info = yaml.safe_load(yaml_file)
+            site_config_data.append(site_info)
+        write_site_config_snapshot(config_dir, signatures, site_config_data)
+    build_site_index()
+    _site_config_source.clear()
+    _site_config_source.update(config_dir=config_dir, signatures=signatures)
 
-def save_site_config(config_dir):
+
+def clear_outdated_site_config():
+    """
+    Forget site configurations if they would not be loaded the same way by read_site_config()
+    now: YAML files in local config dir were added, removed or modified, the local config dir
+    was created or removed, or site configurations from GitHub are older than
+    DEFAULT_SITE_CONFIG_RELOAD_TIME. They are read again by the next read_site_config().
+    Site configurations set directly by library users are kept
+
+    :return: True if site configurations were cleared
+    """
+    if not site_config_data or not _site_config_source:
+        return False
+    config_dir = Path.home() / LOCAL_CONFIG_DIR
+    if "loaded_at" in _site_config_source:
+        outdated = (config_dir.exists()
+                    or time.monotonic() - _site_config_source["loaded_at"] >= DEFAULT_SITE_CONFIG_RELOAD_TIME)
+    else:
+        try:
+            outdated = (_site_config_source["config_dir"] != config_dir
+                        or _site_config_source["signatures"] != get_config_file_signatures(
+                            sorted(config_dir.glob("*.yaml"))))
+        except OSError:
+            # Files removed while checking
+            outdated = True
+    if outdated:
+        site_config_data.clear()
+        _site_config_source.clear()
+        invalidate_site_index()
+    return outdated
+
+
+def get_config_file_signatures(config_files):
     """
-    Save site configs to local directory specified in config_dir. Overwrite local configs if exist
+    Signatures of site configuration files (name, modification time and size)
+    for checking validity of snapshot
+
+    :param config_files: sorted list of paths to YAML files
+
+    :return: list of signatures
+    """
+    signatures = []
+    for f in config_files:
+        stat = f.stat()
+        signatures.append([f.name, stat.st_mtime_ns, stat.st_size])
+    return signatures
+
+
+def read_site_config_snapshot(config_dir, signatures):
+    """
+    Read pre-parsed site configurations from snapshot in config_dir
 
     :param config_dir: path to directory containing site configuration
+    :param signatures: signatures of current YAML files
+
+    :return: list of site configurations, or None if snapshot does not exist or is outdated
+    """
+    try:
+        with (Path(config_dir) / SITE_CONFIG_SNAPSHOT).open(encoding="utf-8") as f:
+            snapshot = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if (not isinstance(snapshot, dict)
+            or snapshot.get("version") != SITE_CONFIG_SNAPSHOT_VERSION
+            or snapshot.get("files") != signatures):
+        return None
+    return snapshot.get("sites")
+
+
+def write_site_config_snapshot(config_dir, signatures, site_configs):
+    """
+    Write site configurations as pre-parsed snapshot to config_dir.
+    Failures are ignored, YAML files will be parsed next time
+
+    :param config_dir: path to directory containing site configuration
+    :param signatures: signatures of YAML files the site configurations were read from
+    :param site_configs: list of site configurations in the same order as signatures
 
     :return: None
     """
+    snapshot = {
+        "version": SITE_CONFIG_SNAPSHOT_VERSION,
+        "files": signatures,
+        "sites": site_configs,
+    }
+    try:
+        fd, tmp_name = tempfile.mkstemp(dir=str(config_dir), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(snapshot, f)
+            os.replace(tmp_name, str(Path(config_dir) / SITE_CONFIG_SNAPSHOT))
+        except BaseException:
+            os.unlink(tmp_name)
+            raise
+    except (OSError, TypeError, ValueError):
+        pass
+
+
+def write_file_atomically(path, content):
+    """
+    Write content to file via temporary file, so readers never see partially written file
+
+    :param path: path to the file
+    :param content: content in bytes
+
+    :return: None
+    """
+    path = Path(path)
+    fd, tmp_name = tempfile.mkstemp(dir=str(path.parent), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(content)
+        os.replace(tmp_name, str(path))
+    except BaseException:
+        os.unlink(tmp_name)
+        raise
+
+
+def read_site_config_sync_state(config_dir):
+    """
+    Names of site configuration files saved to config_dir by previous synchronization
+
+    :return: set of file names
+    """
+    try:
+        with (Path(config_dir) / SITE_CONFIG_SYNC_STATE).open(encoding="utf-8") as f:
+            return set(json.load(f)["files"])
+    except (OSError, ValueError, KeyError, TypeError):
+        return set()
+
+
+def sync_site_config(config_dir):
+    """
+    Synchronize site configurations in local directory with the bundle, or with the listing
+    if the bundle is not available. Git blob SHAs from the listing are compared with the local
+    files, so only added or changed files are downloaded. Files removed from the bundle or
+    listing are deleted, if they were saved by previous synchronization. Site configurations
+    are then read from the local directory
+
+    :param config_dir: path to directory containing site configuration
+
+    :return: dict with lists of file names "added", "changed", "removed" and "unchanged",
+        number of bytes transferred "bytes" and "discovered" (False if neither the bundle
+        nor the listing was available and DEFAULT_SITE_CONFIGS were used)
+    """
     config_dir = Path(config_dir)
     config_dir.mkdir(parents=True, exist_ok=True)
-    for site_info in site_config_data:
-        config_file = config_dir / (site_info["gocdb"] + ".yaml")
-        with config_file.open("w", encoding="utf-8") as f:
-            yaml.dump(site_info, f)
+    local_shas = {f.name: get_git_blob_sha(f.read_bytes()) for f in config_dir.glob("*.yaml")}
+    changes = {"added": [], "changed": [], "removed": [], "unchanged": [], "bytes": 0, "discovered": True}
+
+    bundle = get_site_config_bundle()
+    if bundle is not None:
+        bundle_files, changes["bytes"] = bundle
+        names = set(bundle_files)
+        updates = sorted(bundle_files.items())
+    else:
+        files, changes["discovered"] = list_site_config_files()
+        names = {f["name"] for f in files}
+        outdated = []
+        for f in files:
+            if f["sha"] is not None and local_shas.get(f["name"]) == f["sha"]:
+                changes["unchanged"].append(f["name"])
+            else:
+                outdated.append(f)
+        updates = []
+        for f, (content, size) in zip(outdated, download_site_config_files(outdated)):
+            changes["bytes"] += size
+            updates.append((f["name"], content))
+
+    for name, content in updates:
+        content = content.encode("utf-8")
+        if name not in local_shas:
+            changes["added"].append(name)
+        elif local_shas[name] != get_git_blob_sha(content):
+            changes["changed"].append(name)
+        else:
+            changes["unchanged"].append(name)
+            continue
+        write_file_atomically(config_dir / name, content)
+
+    synced_names = read_site_config_sync_state(config_dir)
+    if changes["discovered"]:
+        # Only the bundle and the listing are authoritative for removals, not the default list
+        for name in sorted(synced_names - names):
+            if name in local_shas:
+                (config_dir / name).unlink()
+                changes["removed"].append(name)
+        synced_names = names
+    else:
+        synced_names |= names
+    write_file_atomically(config_dir / SITE_CONFIG_SYNC_STATE,
+                          json.dumps({"files": sorted(synced_names)}).encode("utf-8"))
+
+    read_local_site_config(config_dir)
+    return changes
+
+
+def save_site_config(config_dir):
+    """
+    Save site configs to local directory specified in config_dir. Kept for library users,
+    site configs are synchronized by sync_site_config(), which also writes the pre-parsed
+    snapshot when reading them
+
+    :param config_dir: path to directory containing site configuration
+
+    :return: None
+    """
+    sync_site_config(config_dir)
 
 
 def list_sites():
@@ -126,11 +641,7 @@ def find_site_data(site_name):
     :return: configuration of site if found, otherwise None
     """
     read_site_config()
-
-    for site_info in site_config_data:
-        if site_info["gocdb"] == site_name:
-            return site_info
-    return None
+    return site_index.get(site_name)
 
 
 def find_endpoint_and_project_id(site_name, vo):
@@ -142,21 +653,42 @@ def find_endpoint_and_project_id(site_name, vo):
 
     :return: endpoint, project_id, protocol if the VO exist on the site, otherwise None, None, None
     """
-    site_info = find_site_data(site_name)
-    if site_info is None:
-        return None, None, None
+    read_site_config()
 
-    protocol = site_info.get("protocol")
     # If only site name is given, return endpoint without project ID
     if vo is None:
-        return site_info["endpoint"], None, protocol
-
-    for vo_info in site_info["vos"]:
-        if vo_info["name"] == vo:
-            return site_info["endpoint"], vo_info["auth"]["project_id"], protocol
+        site_info = site_index.get(site_name)
+        if site_info is None:
+            return None, None, None
+        return site_info["endpoint"], None, site_info.get("protocol")
 
     # Return None, None if VO not found
-    return None, None, None
+    return site_vo_index.get((site_name, vo), (None, None, None))
+
+
+def find_sites_with_vo(vo):
+    """
+    List of sites supporting the VO according to site configuration
+
+    :param vo: VO name
+
+    :return: list of site IDs
+    """
+    read_site_config()
+    return vo_index.get(vo, [])[:]
+
+
+def find_site_vo_pairs(sites, vos):
+    """
+    Combinations of sites and VOs supported by the sites according to site configuration
+
+    :param sites: list of site IDs
+    :param vos: list of VO names
+
+    :return: list of tuples (site ID, VO name) ordered by sites, then by VOs
+    """
+    read_site_config()
+    return [(site_name, vo) for site_name in sites for vo in vos if (site_name, vo) in site_vo_index]
 
 
 @click.group()
@@ -223,13 +755,18 @@ def show_all():
 @site.command()
 def save_config():
     """
-    Read default site configs from GitHub and save them to local folder in home directory
-    Overwrite local configs if exist
+    Synchronize site configs from GitHub to local folder in home directory
+    Only added or changed configs are downloaded, local copies are overwritten
     """
-    read_default_site_config()
+    start_time = time.perf_counter()
     config_dir = Path.home() / LOCAL_CONFIG_DIR
     print("Saving site configs to directory %s" % config_dir)
-    save_site_config(config_dir)
+    changes = sync_site_config(config_dir)
+    if not changes["discovered"]:
+        print("Warning: Bundle and listing of site configs not available, default site configs used")
+    print("Site configs: %d added, %d changed, %d removed, %d unchanged (%d bytes transferred) in %.2f s"
+          % (len(changes["added"]), len(changes["changed"]), len(changes["removed"]), len(changes["unchanged"]),
+             changes["bytes"], time.perf_counter() - start_time))
 
 
 @site.command()
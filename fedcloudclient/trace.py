@@ -0,0 +1,209 @@
+"""
+Tracing of time spent in phases of fedcloud operations: Check-in token refresh
+and OIDC discovery, loading site configurations, GOCDB queries, Keystone
+authentication and the openstack client.
+
+Tracing is disabled by default and costs almost nothing then. When enabled
+(by enable_tracing(), or by "fedcloud --profile" / "fedcloud --trace FILE" in CLI),
+each phase is recorded as a span with its start time, duration and thread. Spans
+can be printed as summary table, or written as JSON trace file in Chrome trace
+format, viewable in chrome://tracing or https://ui.perfetto.dev
+
+Example of library use::
+
+    from fedcloudclient import trace
+    trace.enable_tracing()
+    fedcloud_openstack(token, site, vo, ("server", "list"))
+    trace.print_trace_summary()
+    trace.write_chrome_trace("fedcloud-trace.json")
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+
+_enabled = False
+_spans = []
+_spans_lock = threading.Lock()
+
+# perf_counter() of the time when tracing was enabled, start of all span times
+_origin = 0.0
+
+
+class Span:
+    """
+    Traced phase, used as context manager. Arguments describing the phase (e.g. site)
+    can be added by set() while the span is open
+    """
+    __slots__ = ("name", "category", "args", "start", "duration", "thread_id")
+
+    def __init__(self, name, category, args):
+        self.name = name
+        self.category = category
+        self.args = args
+        self.start = None
+        self.duration = None
+        self.thread_id = None
+
+    def set(self, **args):
+        self.args.update(args)
+
+    def __enter__(self):
+        self.thread_id = threading.get_ident()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.duration = time.perf_counter() - self.start
+        if exc_type is not None:
+            self.args["error"] = exc_type.__name__
+        with _spans_lock:
+            _spans.append(self)
+        return False
+
+
+class _NullSpan:
+    """
+    Span used when tracing is disabled, records nothing
+    """
+    __slots__ = ()
+
+    def set(self, **args):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        return False
+
+
+_null_span = _NullSpan()
+
+
+def span(name, category="fedcloud", **args):
+    """
+    Trace a phase of operation, e.g.::
+
+        with span("GOCDB query", "gocdb", method="get_site_list"):
+            ...
+
+    :param name: name of the phase
+    :param category: category of the phase, e.g. checkin, site-config, gocdb, keystone, openstack
+    :param args: additional information about the phase
+
+    :return: context manager
+    """
+    if not _enabled:
+        return _null_span
+    return Span(name, category, args)
+
+
+def enable_tracing(enabled=True):
+    """
+    Enable (or disable) recording of spans. Enabling clears spans recorded before
+
+    :param enabled: True for enabling, False for disabling tracing
+
+    :return: None
+    """
+    global _enabled, _origin
+    if enabled:
+        clear_spans()
+        _origin = time.perf_counter()
+    _enabled = enabled
+
+
+def is_tracing_enabled():
+    return _enabled
+
+
+def clear_spans():
+    with _spans_lock:
+        _spans.clear()
+
+
+def get_spans():
+    """
+    Return finished spans ordered by their start
+
+    :return: list of Span objects
+    """
+    with _spans_lock:
+        return sorted(_spans, key=lambda s: s.start)
+
+
+def get_trace_summary(spans=None):
+    """
+    Summarize spans by phase
+
+    :param spans: list of spans, None for all recorded spans
+
+    :return: list of [phase, category, calls, total time, mean time, max time] in seconds,
+        in the order of the first call of each phase
+    """
+    phases = {}
+    for s in get_spans() if spans is None else spans:
+        durations = phases.setdefault((s.name, s.category), [])
+        durations.append(s.duration)
+    return [
+        [name, category, len(durations), sum(durations), sum(durations) / len(durations), max(durations)]
+        for (name, category), durations in phases.items()
+    ]
+
+
+def print_trace_summary(spans=None, file=None):
+    """
+    Print summary table of spans. Phases may overlap (nested or concurrent
+    phases), so their times do not add up to the total time
+
+    :param spans: list of spans, None for all recorded spans
+    :param file: output stream, default stderr
+
+    :return: None
+    """
+    file = file or sys.stderr
+    print("%-36s %-12s %6s %11s %11s %11s" % ("phase", "category", "calls", "total [ms]", "mean [ms]", "max [ms]"),
+          file=file)
+    for name, category, calls, total, mean, maximum in get_trace_summary(spans):
+        print("%-36s %-12s %6d %11.1f %11.1f %11.1f"
+              % (name, category, calls, total * 1000, mean * 1000, maximum * 1000), file=file)
+
+
+def get_chrome_trace(spans=None):
+    """
+    Convert spans to Chrome trace format (complete events with times in microseconds)
+
+    :param spans: list of spans, None for all recorded spans
+
+    :return: JSON object of the trace
+    """
+    pid = os.getpid()
+    events = []
+    for s in get_spans() if spans is None else spans:
+        events.append({
+            "name": s.name,
+            "cat": s.category,
+            "ph": "X",
+            "ts": round((s.start - _origin) * 1e6, 1),
+            "dur": round(s.duration * 1e6, 1),
+            "pid": pid,
+            "tid": s.thread_id,
+            "args": {name: str(value) for name, value in s.args.items()},
+        })
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def write_chrome_trace(path, spans=None):
+    """
+    Write spans to JSON trace file in Chrome trace format
+
+    :param path: path to the trace file
+    :param spans: list of spans, None for all recorded spans
+
+    :return: None
+    """
+    with open(path, "w") as f:
+        json.dump(get_chrome_trace(spans), f)
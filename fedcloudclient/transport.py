@@ -0,0 +1,217 @@
+"""
+Shared HTTP transport for all fedcloudclient modules: a single requests session
+with connection pooling (keep-alive), retries with backoff on connection errors
+and 5xx responses, and default timeouts.
+
+Operations with time limit (e.g. processing of one site) set a deadline for the
+current thread by deadline_scope(), timeouts of all requests of the thread are
+then limited by the remaining time
+"""
+
+import contextlib
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Defaults can be changed via environment variables FEDCLOUD_HTTP_*
+DEFAULT_POOL_SIZE = 16
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF_FACTOR = 0.5
+DEFAULT_CONNECT_TIMEOUT = 10
+DEFAULT_READ_TIMEOUT = 60
+
+RETRY_STATUS_CODES = (500, 502, 503, 504)
+
+_session = None
+_session_lock = threading.Lock()
+
+# Deadline (time.monotonic() timestamp) of the operation running in the current thread
+_thread_state = threading.local()
+
+
+class TimeoutSession(requests.Session):
+    """
+    Session with default timeout for all requests
+    """
+
+    def __init__(self, timeout=None):
+        super().__init__()
+        self.timeout = timeout
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        remaining_time = get_remaining_time()
+        if remaining_time is not None:
+            if remaining_time <= 0:
+                raise requests.exceptions.Timeout("Deadline exceeded before request to %s" % url)
+            kwargs["timeout"] = limit_timeout(kwargs["timeout"], remaining_time)
+        return super().request(method, url, **kwargs)
+
+
+class DeadlineRetry(Retry):
+    """
+    Retry configuration respecting the deadline of the current thread: no retries
+    after the deadline, and no waiting between retries beyond it
+    """
+
+    def is_exhausted(self):
+        remaining_time = get_remaining_time()
+        if remaining_time is not None and remaining_time <= 0:
+            return True
+        return super().is_exhausted()
+
+    def get_backoff_time(self):
+        return _limit_wait_time(super().get_backoff_time())
+
+    def get_retry_after(self, response):
+        retry_after = super().get_retry_after(response)
+        return None if retry_after is None else _limit_wait_time(retry_after)
+
+
+def _limit_wait_time(wait_time):
+    remaining_time = get_remaining_time()
+    if remaining_time is None:
+        return wait_time
+    return max(min(wait_time, remaining_time), 0)
+
+
+def limit_timeout(timeout, limit):
+    """
+    Limit requests timeout (number, tuple of connect and read timeouts, or None)
+
+    :return: timeout not longer than limit
+    """
+    if isinstance(timeout, tuple):
+        return tuple(limit if t is None else min(t, limit) for t in timeout)
+    return limit if timeout is None else min(timeout, limit)
+
+
+@contextlib.contextmanager
+def deadline_scope(deadline):
+    """
+    Set deadline of the operation running in the current thread. HTTP requests via
+    the shared session fail with Timeout after the deadline
+
+    :param deadline: time.monotonic() timestamp, None for no deadline
+
+    :return: context manager
+    """
+    previous_deadline = getattr(_thread_state, "deadline", None)
+    _thread_state.deadline = deadline
+    try:
+        yield
+    finally:
+        _thread_state.deadline = previous_deadline
+
+
+def get_remaining_time():
+    """
+    Time remaining to the deadline of the current thread
+
+    :return: remaining time in seconds (negative if exceeded), None if no deadline is set
+    """
+    deadline = getattr(_thread_state, "deadline", None)
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def _get_env_number(name, default, number_type=int):
+    try:
+        return number_type(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+def create_session(
+        pool_size=None,
+        retries=None,
+        backoff_factor=None,
+        connect_timeout=None,
+        read_timeout=None
+):
+    """
+    Create new session with connection pool, retries and timeouts. Parameters
+    not given are taken from FEDCLOUD_HTTP_* environment variables or defaults
+
+    :param pool_size: maximal number of kept connections per host
+    :param retries: number of retries on connection errors and 5xx responses
+    :param backoff_factor: backoff factor between retries (0.5 -> 0.5s, 1s, 2s, ...)
+    :param connect_timeout: timeout for establishing connection in seconds
+    :param read_timeout: timeout for reading response in seconds
+
+    :return: requests session
+    """
+    if pool_size is None:
+        pool_size = _get_env_number("FEDCLOUD_HTTP_POOL_SIZE", DEFAULT_POOL_SIZE)
+    if retries is None:
+        retries = _get_env_number("FEDCLOUD_HTTP_RETRIES", DEFAULT_RETRIES)
+    if backoff_factor is None:
+        backoff_factor = _get_env_number("FEDCLOUD_HTTP_BACKOFF_FACTOR", DEFAULT_BACKOFF_FACTOR, float)
+    if connect_timeout is None:
+        connect_timeout = _get_env_number("FEDCLOUD_HTTP_CONNECT_TIMEOUT", DEFAULT_CONNECT_TIMEOUT, float)
+    if read_timeout is None:
+        read_timeout = _get_env_number("FEDCLOUD_HTTP_READ_TIMEOUT", DEFAULT_READ_TIMEOUT, float)
+
+    # Status codes are retried only for idempotent methods, connection errors for all methods.
+    # Responses are returned after the last retry, status codes are checked by callers
+    retry = DeadlineRetry(
+        total=retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=RETRY_STATUS_CODES,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = TimeoutSession(timeout=(connect_timeout, read_timeout))
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_session():
+    """
+    Return the shared session, create it at the first call
+
+    :return: requests session
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = create_session()
+    return _session
+
+
+def set_session(session):
+    """
+    Replace the shared session, e.g. by session with different settings.
+    None for creating new default session at the next use
+
+    :param session: requests session or None
+
+    :return: None
+    """
+    global _session
+    with _session_lock:
+        old_session = _session
+        _session = session
+    if old_session is not None and old_session is not session:
+        old_session.close()
+
+
+def get(url, **kwargs):
+    """
+    HTTP GET via the shared session
+    """
+    return get_session().get(url, **kwargs)
+
+
+def post(url, **kwargs):
+    """
+    HTTP POST via the shared session
+    """
+    return get_session().post(url, **kwargs)